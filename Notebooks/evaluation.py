@@ -0,0 +1,239 @@
+'''Vectorized top-k evaluation of deep_learning.ipynb
+
+A sample of t tubes is scored on the sets of its t highest labels and t
+highest logits, over the class + n_classes*fraction bucket layout of
+input_pipeline.parse_batch. Whole batches are ranked with argpartition,
+and TopKEvaluation accumulates, across batches,
+
+- the notebook's accuracy (sorted, zero padded sets compared element by
+  element) and exact top-1/2/3 set matches by number of tubes,
+- a 2x2 confusion matrix of every chirality (present / predicted),
+- the fraction bucket accuracy of the tubes whose chirality was found.
+
+    python evaluation.py
+
+benchmarks it against the notebook's per-sample argsort loop.
+'''
+from typing import Dict, List, Optional, Tuple
+import argparse
+import time
+import numpy as np
+
+
+# tube slots of a sample
+MAX_TUBES: int = 3
+
+
+def ranked(
+        scores: np.ndarray, num_tubes: np.ndarray, max_tubes: int = MAX_TUBES
+        ) -> Tuple[np.ndarray, np.ndarray]:
+    '''(indices, valid) of the max_tubes highest scores of every row, best
+    first; valid masks the num_tubes slots that count'''
+    best = np.argpartition(-scores, max_tubes-1, axis=1)[:, :max_tubes]
+    rows = np.arange(len(scores))[:, None]
+    best = best[rows, np.argsort(-scores[rows, best], axis=1)]
+    num_tubes = np.asarray(num_tubes).astype(int)
+    if np.any((num_tubes < 1) | (num_tubes > max_tubes)):
+        raise ValueError(
+                f'number of tubes must be in 1...{max_tubes}, got '
+                f'{np.unique(num_tubes)}'
+                )
+    return best, np.arange(max_tubes) < num_tubes[:, None]
+
+
+def top_k_sets(
+        scores: np.ndarray, num_tubes: np.ndarray, max_tubes: int = MAX_TUBES
+        ) -> np.ndarray:
+    '''(samples, max_tubes) sorted indices of the num_tubes highest scores
+    of every row, empty slots 0: y_lab and y_logit of the notebook'''
+    best, valid = ranked(scores, num_tubes, max_tubes)
+    return np.sort(np.where(valid, best, 0), axis=1)
+
+
+def loop_top_k_sets(scores: np.ndarray, tube_index: np.ndarray
+                    ) -> np.ndarray:
+    '''the notebook's per-sample loop over y_ind[:, 0], for comparison'''
+    out = np.empty([len(scores), 3])
+    for i in range(len(scores)):
+        if tube_index[i] == 2:
+            out[i] = np.argsort(scores[i])[-3:]
+            out[i] = np.sort(out[i])
+        elif tube_index[i] == 1:
+            z = np.argsort(scores[i])[-2:]
+            out[i] = np.append(z, [0])
+            out[i] = np.sort(out[i])
+        elif tube_index[i] == 0:
+            z = np.argsort(scores[i])[-1:]
+            out[i] = np.append(z, [0, 0])
+            out[i] = np.sort(out[i])
+        else:
+            print('Something Wrong happened!!!')
+    return out
+
+
+class TopKEvaluation:
+    '''streaming top-k metrics of (logits, labels, number of tubes) batches
+
+        evaluation = TopKEvaluation(n_classes, fraction_levels)
+        for ...:
+            acc = evaluation.update(logit, y_tr, y_ind[:, 0] + 1)
+        evaluation.summary()
+    '''
+
+    def __init__(self, n_classes: int, fraction_levels: int = 3,
+                 max_tubes: int = MAX_TUBES):
+        self.n_classes = n_classes
+        self.fraction_levels = fraction_levels
+        self.max_tubes = max_tubes
+        self.element_hits = 0
+        self.elements = 0
+        # indexed by number of tubes - 1
+        self.set_hits = np.zeros(max_tubes, dtype=np.int64)
+        self.set_counts = np.zeros(max_tubes, dtype=np.int64)
+        # [chirality, present, predicted]
+        self.confusion = np.zeros((n_classes, 2, 2), dtype=np.int64)
+        # tubes found with the right chirality, by their true bucket
+        self.bucket_hits = np.zeros(fraction_levels, dtype=np.int64)
+        self.bucket_counts = np.zeros(fraction_levels, dtype=np.int64)
+
+    def update(self, logits: np.ndarray, labels: np.ndarray,
+               num_tubes: np.ndarray) -> float:
+        '''add a batch; returns its accuracy as the notebook computed it'''
+        num_tubes = np.asarray(num_tubes).astype(int)
+        true, valid = ranked(labels, num_tubes, self.max_tubes)
+        predicted, _ = ranked(logits, num_tubes, self.max_tubes)
+
+        # the notebook's sorted, zero padded sets
+        matches = (np.sort(np.where(valid, true, 0), axis=1)
+                   == np.sort(np.where(valid, predicted, 0), axis=1))
+        self.element_hits += int(matches.sum())
+        self.elements += matches.size
+        self.set_hits += np.bincount(num_tubes[matches.all(axis=1)] - 1,
+                                     minlength=self.max_tubes)
+        self.set_counts += np.bincount(num_tubes - 1,
+                                       minlength=self.max_tubes)
+
+        true_bucket, true_class = np.divmod(true, self.n_classes)
+        predicted_class = predicted % self.n_classes
+        present = self._membership(true_class, valid)
+        found = self._membership(predicted_class, valid)
+        for is_present in (False, True):
+            for is_found in (False, True):
+                self.confusion[:, int(is_present), int(is_found)] += (
+                        (present == is_present) & (found == is_found)
+                        ).sum(axis=0)
+
+        # [sample, true slot, predicted slot]
+        both = valid[:, :, None] & valid[:, None, :]
+        class_found = (both & (true_class[:, :, None]
+                               == predicted_class[:, None, :])).any(axis=2)
+        bucket_found = (both & (true[:, :, None]
+                                == predicted[:, None, :])).any(axis=2)
+        self.bucket_counts += np.bincount(
+                true_bucket[class_found], minlength=self.fraction_levels)
+        self.bucket_hits += np.bincount(
+                true_bucket[bucket_found], minlength=self.fraction_levels)
+        return float(matches.mean())
+
+    def _membership(self, classes: np.ndarray, valid: np.ndarray
+                    ) -> np.ndarray:
+        '''(samples, n_classes) chiralities among the valid slots'''
+        member = np.zeros((len(classes), self.n_classes), dtype=bool)
+        rows = np.broadcast_to(np.arange(len(classes))[:, None],
+                               classes.shape)
+        member[rows[valid], classes[valid]] = True
+        return member
+
+    @property
+    def accuracy(self) -> float:
+        '''the notebook's accuracy over every batch so far'''
+        return self.element_hits/max(self.elements, 1)
+
+    @property
+    def set_accuracy(self) -> np.ndarray:
+        '''exact top-t set matches of samples of 1...max_tubes tubes'''
+        return self.set_hits/np.maximum(self.set_counts, 1)
+
+    @property
+    def bucket_accuracy(self) -> np.ndarray:
+        '''right fraction bucket of the tubes whose chirality was found,
+        by true bucket'''
+        return self.bucket_hits/np.maximum(self.bucket_counts, 1)
+
+    def chirality_recall(self) -> np.ndarray:
+        '''tubes of every chirality that were predicted'''
+        return self.confusion[:, 1, 1]/np.maximum(
+                self.confusion[:, 1].sum(axis=1), 1)
+
+    def chirality_precision(self) -> np.ndarray:
+        '''predictions of every chirality that were right'''
+        return self.confusion[:, 1, 1]/np.maximum(
+                self.confusion[:, :, 1].sum(axis=1), 1)
+
+    def summary(self) -> Dict[str, object]:
+        return {
+            'accuracy': self.accuracy,
+            'set_accuracy': self.set_accuracy.tolist(),
+            'bucket_accuracy': self.bucket_accuracy.tolist(),
+            'mean_chirality_recall': float(self.chirality_recall().mean()),
+            'samples': int(self.set_counts.sum()),
+        }
+
+
+def _random_batch(
+        rng: np.random.Generator, batch_size: int, n_classes: int,
+        fraction_levels: int
+        ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    '''(logits, labels, tube index) of random samples with distinct tubes'''
+    width = n_classes*fraction_levels
+    tube_index = rng.integers(0, MAX_TUBES, batch_size)
+    labels = np.zeros((batch_size, width), dtype=np.float32)
+    for i, tubes in enumerate(tube_index + 1):
+        labels[i, rng.choice(width, tubes, replace=False)] = 1.0
+    logits = (rng.normal(size=(batch_size, width)) + 3*labels).astype(
+            np.float32)
+    return logits, labels, tube_index
+
+
+def benchmark(
+        batch_size: int = 1000, batches: int = 20, n_classes: int = 38,
+        fraction_levels: int = 3
+        ) -> Dict[str, float]:
+    '''ms per batch of the vectorized evaluation and the notebook loop'''
+    rng = np.random.default_rng(0)
+    data = [_random_batch(rng, batch_size, n_classes, fraction_levels)
+            for _ in range(batches)]
+    evaluation = TopKEvaluation(n_classes, fraction_levels)
+    start = time.perf_counter()
+    accuracies = [evaluation.update(logits, labels, tube_index + 1)
+                  for logits, labels, tube_index in data]
+    vectorized = (time.perf_counter() - start)/batches
+
+    start = time.perf_counter()
+    loop_accuracies = [
+            float(np.mean(loop_top_k_sets(logits, tube_index)
+                          == loop_top_k_sets(labels, tube_index)))
+            for logits, labels, tube_index in data]
+    loop = (time.perf_counter() - start)/batches
+    if not np.allclose(accuracies, loop_accuracies):
+        raise AssertionError('vectorized and loop accuracies differ')
+    return {'vectorized': 1000*vectorized, 'loop': 1000*loop}
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='top-k evaluation benchmark')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--batches', type=int, default=20)
+    parser.add_argument('--n-classes', type=int, default=38)
+    parser.add_argument('--fraction-levels', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    result = benchmark(args.batch_size, args.batches, args.n_classes,
+                       args.fraction_levels)
+    for name, ms in result.items():
+        print(f'{name:>10}: {ms:8.2f} ms/batch')
+    print(f"loop / vectorized: {result['loop']/result['vectorized']:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,277 @@
+'''Binary input pipeline for deep_learning.ipynb
+
+Samples are read from the float32 .npy shards written by
+streamlit/generate_dataset.py as fixed-length binary records, so nothing
+is parsed as text while training. Shards are interleaved in parallel,
+records go through a shuffle buffer, and each batch is decoded and
+labelled in one vectorized step before being prefetched.
+
+    python input_pipeline.py --samples 20000
+
+benchmarks it against the TextLineReader/decode_csv path on the same data.
+'''
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, \
+        Tuple
+from pathlib import Path
+import argparse
+import tempfile
+import time
+import numpy as np
+import tensorflow as tf
+from splits import SplitManifest
+
+
+# columns per sample (X_length) and length of the network input
+SAMPLE_WIDTH: int = 4511
+PROFILE_LENGTH: int = 4501
+# bucket edges of the 3, 4 and 5 level fraction predictions
+FRACTION_LEVELS: Dict[int, Tuple[float, ...]] = {
+        3: (0.3333, 0.6667),
+        4: (0.25, 0.5, 0.75),
+        5: (0.2, 0.4, 0.6, 0.8)}
+
+
+def npy_layout(path: str) -> Tuple[int, int]:
+    '''(data offset, samples) of a float32 (samples, SAMPLE_WIDTH) .npy'''
+    with open(path, 'rb') as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = \
+                np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = \
+                np.lib.format.read_array_header_2_0(f)
+        if (dtype != np.dtype('<f4') or fortran_order
+                or len(shape) != 2 or shape[1] != SAMPLE_WIDTH):
+            raise ValueError(
+                    f'{path} is not a float32 (samples, {SAMPLE_WIDTH}) '
+                    f'shard: {dtype}, shape {shape}'
+                    )
+        return f.tell(), shape[0]
+
+
+def parse_batch(
+        xy_data: tf.Tensor, n_classes: int, fraction_levels: int = 3
+        ) -> Tuple[tf.Tensor, ...]:
+    '''[batch, SAMPLE_WIDTH] rows -> (X, y_data, y_p, y_ind) of the notebook
+
+    y_data is the sum of the one-hot class + fraction bucket of every tube,
+    as built with tf.cond/tf.one_hot per sample in the notebook; empty tube
+    slots (class -1) contribute nothing.
+    '''
+    X = xy_data[:, :PROFILE_LENGTH]
+    classes = tf.cast(xy_data[:, -7:-4], tf.int32)
+    fractions = xy_data[:, -4:-1]
+    edges = tf.constant(FRACTION_LEVELS[fraction_levels], dtype=tf.float32)
+    bucket = tf.reduce_sum(
+            tf.cast(fractions[..., None] >= edges, tf.int32), axis=-1
+            )
+    y_data = tf.reduce_sum(
+            tf.one_hot(classes + n_classes*bucket, n_classes*fraction_levels),
+            axis=1
+            )
+    y_p, _ = tf.nn.top_k(fractions, k=3, sorted=True)
+    y_ind = xy_data[:, -1:]
+    return X, y_data, y_p, y_ind
+
+
+def shard_dataset(
+        files: Sequence[str], batch_size: int, n_classes: int,
+        fraction_levels: int = 3, shuffle_buffer: int = 10000,
+        cycle_length: int = 4, repeat: bool = True,
+        seed: Optional[int] = None, rows: Optional[np.ndarray] = None
+        ) -> tf.data.Dataset:
+    '''batches of (X, y_data, y_p, y_ind) streamed from .npy shards
+
+    rows restricts the stream to those global row indices of the
+    concatenated files, e.g. one split of a splits.SplitManifest; only
+    their records are read, see rows_dataset.
+    '''
+    files = [str(f) for f in files]
+    if rows is not None:
+        return rows_dataset(files, rows, batch_size, n_classes,
+                            fraction_levels, shuffle_buffer > 0, repeat,
+                            seed)
+    headers = [npy_layout(f)[0] for f in files]
+    record_bytes = SAMPLE_WIDTH*np.dtype(np.float32).itemsize
+
+    def read_shard(path, header):
+        return tf.data.FixedLengthRecordDataset(path, record_bytes,
+                                                header_bytes=header)
+
+    dataset = tf.data.Dataset.from_tensor_slices(
+            (files, tf.constant(headers, dtype=tf.int64))
+            )
+    if repeat:
+        dataset = dataset.shuffle(len(files), seed=seed).repeat()
+    dataset = dataset.interleave(
+            read_shard, cycle_length=cycle_length,
+            num_parallel_calls=tf.data.experimental.AUTOTUNE
+            )
+    if shuffle_buffer:
+        dataset = dataset.shuffle(shuffle_buffer, seed=seed)
+    return (dataset
+            .batch(batch_size, drop_remainder=True)
+            .map(lambda records: parse_batch(
+                     tf.io.decode_raw(records, tf.float32),
+                     n_classes, fraction_levels),
+                 num_parallel_calls=tf.data.experimental.AUTOTUNE)
+            .prefetch(tf.data.experimental.AUTOTUNE))
+
+
+def rows_dataset(
+        files: Sequence[str], rows: np.ndarray, batch_size: int,
+        n_classes: int, fraction_levels: int = 3, shuffle: bool = True,
+        repeat: bool = True, seed: Optional[int] = None
+        ) -> tf.data.Dataset:
+    '''batches of (X, y_data, y_p, y_ind) of some global rows of shards
+
+    Only the row indices go through tf.data (shuffled in full, every
+    epoch, with shuffle); each batch of them is gathered from memory maps
+    of the shards, so a split reads just its own records.
+    '''
+    layouts = [npy_layout(f) for f in files]
+    shards = [np.memmap(f, dtype='<f4', mode='r', offset=header,
+                        shape=(size, SAMPLE_WIDTH))
+              for f, (header, size) in zip(files, layouts)]
+    offsets = np.cumsum([0] + [size for _, size in layouts])
+
+    def gather(batch_rows: np.ndarray) -> np.ndarray:
+        out = np.empty((len(batch_rows), SAMPLE_WIDTH), dtype=np.float32)
+        shard = np.searchsorted(offsets, batch_rows, side='right') - 1
+        for i in np.unique(shard):
+            inside = shard == i
+            out[inside] = shards[i][batch_rows[inside] - offsets[i]]
+        return out
+
+    def read_batch(batch_rows: tf.Tensor) -> tf.Tensor:
+        xy_data = tf.numpy_function(gather, [batch_rows], tf.float32)
+        xy_data.set_shape([batch_size, SAMPLE_WIDTH])
+        return xy_data
+
+    rows = np.asarray(rows, dtype=np.int64)
+    dataset = tf.data.Dataset.from_tensor_slices(rows)
+    if shuffle:
+        dataset = dataset.shuffle(len(rows), seed=seed)
+    if repeat:
+        dataset = dataset.repeat()
+    return (dataset
+            .batch(batch_size, drop_remainder=True)
+            .map(read_batch,
+                 num_parallel_calls=tf.data.experimental.AUTOTUNE)
+            .map(lambda xy_data: parse_batch(xy_data, n_classes,
+                                             fraction_levels),
+                 num_parallel_calls=tf.data.experimental.AUTOTUNE)
+            .prefetch(tf.data.experimental.AUTOTUNE))
+
+
+def split_dataset(
+        manifest: SplitManifest, split: str, batch_size: int,
+        n_classes: int, fraction_levels: int = 3, **kwargs
+        ) -> tf.data.Dataset:
+    '''shard_dataset over one split of a manifest, without copying files'''
+    return shard_dataset(manifest.shards, batch_size, n_classes,
+                         fraction_levels, seed=manifest.seed,
+                         rows=getattr(manifest, split), **kwargs)
+
+
+def stream_dataset(
+        batches: Callable[[], Iterator[np.ndarray]], n_classes: int,
+        fraction_levels: int = 3
+        ) -> tf.data.Dataset:
+    '''batches of (X, y_data, y_p, y_ind) from a generator of sample rows
+
+    batches returns an iterator of (batch, SAMPLE_WIDTH) float32 arrays,
+    e.g. a streamlit/sample_stream.py SampleStream simulating fresh
+    samples while training, so nothing is read from disk.
+    '''
+    return (tf.data.Dataset.from_generator(
+                batches, output_types=tf.float32,
+                output_shapes=tf.TensorShape([None, SAMPLE_WIDTH]))
+            .map(lambda xy_data: parse_batch(xy_data, n_classes,
+                                             fraction_levels),
+                 num_parallel_calls=tf.data.experimental.AUTOTUNE)
+            .prefetch(tf.data.experimental.AUTOTUNE))
+
+
+def csv_dataset(
+        files: Sequence[str], batch_size: int, n_classes: int,
+        fraction_levels: int = 3
+        ) -> tf.data.Dataset:
+    '''the notebook's TextLineReader/decode_csv path, for comparison'''
+    record_defaults = [tf.constant([0], dtype=tf.float32)
+                       for _ in range(SAMPLE_WIDTH)]
+    return (tf.data.TextLineDataset([str(f) for f in files])
+            .repeat()
+            .map(lambda line: tf.stack(
+                     tf.io.decode_csv(line, record_defaults=record_defaults)))
+            .batch(batch_size, drop_remainder=True)
+            .map(lambda xy_data: parse_batch(xy_data, n_classes,
+                                             fraction_levels)))
+
+
+def batch_tensors(dataset: tf.data.Dataset) -> Tuple[tf.Tensor, ...]:
+    '''graph-mode (X, y_data, y_p, y_ind) tensors, like tf.train.batch'''
+    return tf.compat.v1.data.make_one_shot_iterator(dataset).get_next()
+
+
+def _write_benchmark_data(
+        directory: Path, num_samples: int, rows_per_csv: int = 100
+        ) -> Tuple[List[str], List[str]]:
+    '''the same random samples as one .npy shard and as CSV files'''
+    rng = np.random.default_rng(0)
+    samples = rng.random((num_samples, SAMPLE_WIDTH), dtype=np.float32)
+    samples[:, -7:-4] = rng.integers(0, 38, (num_samples, 3))
+    samples[:, -1] = 2
+    shard = directory / 'shard_00000.npy'
+    np.save(shard, samples)
+    csv_files = []
+    for i, start in enumerate(range(0, num_samples, rows_per_csv)):
+        path = directory / f'{i}.csv'
+        np.savetxt(path, samples[start:start+rows_per_csv],
+                   delimiter=',', fmt='%.7g')
+        csv_files.append(str(path))
+    return [str(shard)], csv_files
+
+
+def throughput(dataset: tf.data.Dataset, batches: int) -> float:
+    '''samples per second drawn from dataset, after one warm-up batch'''
+    iterator = iter(dataset)
+    X = next(iterator)[0]
+    start = time.perf_counter()
+    for _ in range(batches):
+        X = next(iterator)[0]
+    return batches*int(X.shape[0]) / (time.perf_counter() - start)
+
+
+def benchmark(
+        num_samples: int = 20000, batch_size: int = 1000, batches: int = 20,
+        n_classes: int = 38
+        ) -> Dict[str, float]:
+    '''samples/s of the binary and CSV pipelines on the same data'''
+    with tempfile.TemporaryDirectory() as directory:
+        shards, csv_files = _write_benchmark_data(Path(directory),
+                                                  num_samples)
+        return {
+            'binary': throughput(
+                shard_dataset(shards, batch_size, n_classes), batches),
+            'csv': throughput(
+                csv_dataset(csv_files, batch_size, n_classes), batches),
+        }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='input pipeline benchmark')
+    parser.add_argument('--samples', type=int, default=20000)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--batches', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    result = benchmark(args.samples, args.batch_size, args.batches)
+    for name, rate in result.items():
+        print(f'{name:>6}: {rate:10.0f} samples/s')
+    print(f"binary / csv: {result['binary']/result['csv']:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+'''Train/validation/test split manifests over the generated shards
+
+A split is a seeded set of row indices into the concatenated .npy shards
+of streamlit/generate_dataset.py, not a copy of the files, so the data
+stays in one place and re-splitting takes no time or extra storage.
+
+    manifest = make_split(files, num_validation=1000, num_test=1000,
+                          seed=777, stratify=True)
+    save_split('split.npz', manifest)
+'''
+from typing import Dict, NamedTuple, Sequence, Tuple
+import numpy as np
+
+
+# column of the first tube's class id (y_1) in a sample
+CLASS_COLUMN: int = -7
+
+
+class SplitManifest(NamedTuple):
+    shards: Tuple[str, ...]  # .npy files, in order
+    shard_sizes: np.ndarray  # samples per shard
+    train: np.ndarray  # sorted global row indices of each split
+    validation: np.ndarray
+    test: np.ndarray
+    seed: int
+
+    @property
+    def offsets(self) -> np.ndarray:
+        '''global index of the first row of every shard'''
+        return np.concatenate([[0], np.cumsum(self.shard_sizes)[:-1]])
+
+    def rows_by_shard(self, split: str) -> Dict[str, np.ndarray]:
+        '''local row indices of split in every shard'''
+        rows = getattr(self, split)
+        shard = np.searchsorted(self.offsets, rows, side='right') - 1
+        return {path: rows[shard == i] - self.offsets[i]
+                for i, path in enumerate(self.shards)}
+
+    def load(self, split: str) -> np.ndarray:
+        '''(samples, columns) of split, read through memory maps'''
+        return np.concatenate([
+                np.load(path, mmap_mode='r')[rows]
+                for path, rows in self.rows_by_shard(split).items()
+                ])
+
+
+def _shard_sizes(shards: Sequence[str]) -> np.ndarray:
+    return np.array([np.load(path, mmap_mode='r').shape[0]
+                     for path in shards])
+
+
+def make_split(
+        shards: Sequence[str], num_validation: int, num_test: int,
+        seed: int = 0, stratify: bool = False
+        ) -> SplitManifest:
+    '''seeded split of the rows of shards
+
+    With stratify, every chirality (class of the first tube) is divided
+    between the splits in the same proportions as the whole set, so the
+    validation and test sizes are then only approximately those requested.
+    '''
+    shards = tuple(str(path) for path in shards)
+    sizes = _shard_sizes(shards)
+    total = int(sizes.sum())
+    if num_validation + num_test > total:
+        raise ValueError(
+                f'{num_validation} + {num_test} held-out samples requested '
+                f'from only {total}'
+                )
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(total)
+
+    if stratify:
+        labels = np.concatenate([
+                np.load(path, mmap_mode='r')[:, CLASS_COLUMN]
+                for path in shards
+                ])
+        # random order within each class, then rank as a fraction of it
+        order = order[np.argsort(labels[order], kind='stable')]
+        _, start, count = np.unique(labels[order], return_index=True,
+                                    return_counts=True)
+        rank = np.arange(total) - np.repeat(start, count)
+        position = (rank + rng.random(total)) / np.repeat(count, count)
+        bounds = np.array([num_validation, num_validation+num_test]) / total
+        split_of = np.searchsorted(bounds, position, side='right')
+        validation, test, train = (order[split_of == i] for i in range(3))
+    else:
+        validation = order[:num_validation]
+        test = order[num_validation:num_validation+num_test]
+        train = order[num_validation+num_test:]
+
+    return SplitManifest(shards, sizes, np.sort(train), np.sort(validation),
+                         np.sort(test), seed)
+
+
+def save_split(path: str, manifest: SplitManifest) -> None:
+    np.savez(path, shards=np.array(manifest.shards),
+             shard_sizes=manifest.shard_sizes, train=manifest.train,
+             validation=manifest.validation, test=manifest.test,
+             seed=manifest.seed)
+
+
+def load_split(path: str) -> SplitManifest:
+    with np.load(path) as f:
+        return SplitManifest(tuple(str(s) for s in f['shards']),
+                             f['shard_sizes'], f['train'], f['validation'],
+                             f['test'], int(f['seed']))
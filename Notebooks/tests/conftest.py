@@ -0,0 +1,5 @@
+'''the notebooks' modules are imported flat from Notebooks/'''
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
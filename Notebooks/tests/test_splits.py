@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+from splits import CLASS_COLUMN, load_split, make_split, save_split
+
+
+@pytest.fixture
+def shards(tmp_path):
+    # 3 shards of 10 columns, the row's global index in column 0 and one
+    # of 4 classes in the class column
+    rng = np.random.default_rng(0)
+    paths, start = [], 0
+    for i, size in enumerate((50, 120, 30)):
+        rows = np.zeros((size, 10))
+        rows[:, 0] = np.arange(start, start + size)
+        rows[:, CLASS_COLUMN] = rng.integers(0, 4, size)
+        paths.append(tmp_path / f'shard{i}.npy')
+        np.save(paths[-1], rows)
+        start += size
+    return paths
+
+
+@pytest.mark.parametrize('stratify', [False, True])
+def test_splits_are_disjoint_and_cover_every_row(shards, stratify):
+    manifest = make_split(shards, 20, 30, seed=7, stratify=stratify)
+    train, validation, test = (set(manifest.train.tolist()),
+                               set(manifest.validation.tolist()),
+                               set(manifest.test.tolist()))
+    assert not train & validation and not train & test \
+        and not validation & test
+    assert train | validation | test == set(range(200))
+    if not stratify:
+        assert (len(validation), len(test)) == (20, 30)
+    # the rows loaded through the shards are the ones indexed
+    for split in ('train', 'validation', 'test'):
+        assert np.array_equal(manifest.load(split)[:, 0],
+                              getattr(manifest, split))
+
+
+def test_split_is_seeded_and_saved(shards, tmp_path):
+    manifest = make_split(shards, 20, 30, seed=7)
+    again = make_split(shards, 20, 30, seed=7)
+    other = make_split(shards, 20, 30, seed=8)
+    assert np.array_equal(manifest.test, again.test)
+    assert not np.array_equal(manifest.test, other.test)
+    save_split(tmp_path / 'split.npz', manifest)
+    loaded = load_split(tmp_path / 'split.npz')
+    assert loaded.shards == manifest.shards and loaded.seed == 7
+    for split in ('train', 'validation', 'test'):
+        assert np.array_equal(getattr(loaded, split),
+                              getattr(manifest, split))
+
+
+def test_too_many_held_out_rows(shards):
+    with pytest.raises(ValueError):
+        make_split(shards, 150, 51)
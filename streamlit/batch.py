@@ -0,0 +1,143 @@
+'''Vectorized simulation of many (n, m, scale) states at once'''
+from typing import List, Optional, Tuple
+from pathlib import Path
+import numpy as np
+from bessel import bessel_table
+from core import BASIS_A0, INDICES_CSV, RESOLUTION, chiralAngle, \
+        chiralIndices, diameter, layer_line_rows, visible_layer_lines
+from layer_lines import layer_line_orders, layer_line_spacings, reflections
+from pattern import LayerLinePattern
+
+
+# tubes per bessel_table, bounds its (orders, tubes, RESOLUTION) float64
+CHUNK_SIZE: int = 64
+
+
+def load_indices(path: Path = INDICES_CSV, unique: bool = False
+                 ) -> Tuple[np.ndarray, ...]:
+    '''(n, m, factor) columns of indices.csv as int arrays; with unique,
+    only the first row of every (n, m), as generate_dataset's classes'''
+    key_value = np.loadtxt(path, delimiter=',', ndmin=2).astype(int)
+    if unique:
+        _, first = np.unique(key_value[:, :2], axis=0, return_index=True)
+        key_value = key_value[np.sort(first)]
+    return key_value[:, 0], key_value[:, 1], key_value[:, 2]
+
+
+def batch_bessel_orders(chiral_n: np.ndarray, chiral_m: np.ndarray,
+                        num_layer_lines: int = 4) -> np.ndarray:
+    '''Bessel orders of l0...l_num_layer_lines, shape (..., lines)'''
+    return layer_line_orders(reflections(num_layer_lines),
+                             np.asarray(chiral_n)[..., None],
+                             np.asarray(chiral_m)[..., None])
+
+
+def unit_axis(half: bool = False) -> np.ndarray:
+    '''radial axis over -1...1 (0...1 with half) of RESOLUTION points'''
+    axis = np.linspace(-1.0, 1.0, RESOLUTION)
+    return axis[RESOLUTION//2:] if half else axis
+
+
+def batch_layer_lines(
+        chiral_n: np.ndarray, chiral_m: np.ndarray, scale: np.ndarray,
+        num_layer_lines: int = 4, out: Optional[np.ndarray] = None,
+        half: bool = False
+        ) -> np.ndarray:
+    '''|J|^2 profiles of layer lines l0...l_num_layer_lines for many tubes
+
+    chiral_n, chiral_m and scale are broadcast against each other, so a
+    sweep over every tube and a grid of scales is e.g.
+    batch_layer_lines(n, m, scales[:, None]). Returns float32 of shape
+    broadcast_shape + (num_layer_lines+1, RESOLUTION), written into out
+    when given. With half only the x >= 0 half of the (symmetric) radial
+    axis is evaluated, RESOLUTION//2 points.
+    '''
+    chiral_n, chiral_m, scale = np.broadcast_arrays(
+            np.asarray(chiral_n, dtype=int), np.asarray(chiral_m, dtype=int),
+            np.asarray(scale, dtype=float)
+            )
+    axis = unit_axis(half)
+    shape = chiral_n.shape + (num_layer_lines+1, len(axis))
+    if out is None:
+        out = np.empty(shape, dtype=np.float32)
+    elif out.shape != shape or out.dtype != np.float32:
+        raise ValueError(
+                f'out must be float32 with shape {shape}, '
+                f'got {out.dtype} with shape {out.shape}'
+                )
+
+    orders = batch_bessel_orders(chiral_n.ravel(), chiral_m.ravel(),
+                                 num_layer_lines)
+    # radial_axis of every tube: pi*scale*d times the unit axis
+    extent = np.pi*scale.ravel()*diameter(chiralIndices(chiral_n.ravel(),
+                                                        chiral_m.ravel()))
+    flat_out = out.reshape((-1,) + shape[-2:])
+    for start in range(0, len(extent), CHUNK_SIZE):
+        chunk = slice(start, start+CHUNK_SIZE)
+        # every order up to the chunk's highest in one recurrence pass
+        table = bessel_table(orders[chunk].max(),
+                             extent[chunk, None]*axis)
+        tubes = np.arange(table.shape[1])[:, None]
+        np.square(table[orders[chunk], tubes], out=flat_out[chunk],
+                  casting='same_kind')
+    return out
+
+
+def batch_layer_line_rows(
+        chiral_n: np.ndarray, chiral_m: np.ndarray, scale: np.ndarray,
+        factor: np.ndarray, num_layer_lines: int = 4
+        ) -> Tuple[np.ndarray, np.ndarray]:
+    '''(positive, negative) mesh rows of each layer line, as diffract_plot
+
+    Lines whose positive row + 2 exceeds RESOLUTION are off the plot.
+    '''
+    chiral_n, chiral_m, scale, factor = np.broadcast_arrays(
+            chiral_n, chiral_m, scale, factor
+            )
+    indices = chiralIndices(chiral_n, chiral_m)
+    positions = layer_line_spacings(reflections(num_layer_lines),
+                                    chiralAngle(indices)[..., None], BASIS_A0)
+    diffraction_distance = np.pi*diameter(indices)*scale/factor
+    return layer_line_rows(positions, diffraction_distance[..., None])
+
+
+def batch_patterns(
+        chiral_n: np.ndarray, chiral_m: np.ndarray, scale: np.ndarray,
+        factor: np.ndarray, num_layer_lines: int = 3, lines: str = 'Yes',
+        half: bool = False
+        ) -> List[LayerLinePattern]:
+    '''Linear diffract_pattern of every tube, from one batched evaluation'''
+    chiral_n, chiral_m, scale, factor = (
+            a.ravel() for a in np.broadcast_arrays(chiral_n, chiral_m,
+                                                   scale, factor)
+            )
+    profiles = batch_layer_lines(chiral_n, chiral_m, scale, num_layer_lines,
+                                 half=half)
+    pos_rows, neg_rows = batch_layer_line_rows(chiral_n, chiral_m, scale,
+                                               factor, num_layer_lines)
+    extent = np.pi*scale*diameter(chiralIndices(chiral_n, chiral_m))
+    axis = unit_axis(half)
+
+    patterns = []
+    for i in range(len(chiral_n)):
+        visible, line_profiles = visible_layer_lines(pos_rows[i],
+                                                     profiles[i], lines)
+        patterns.append(LayerLinePattern(
+                extent[i]*axis, pos_rows[i, visible],
+                neg_rows[i, visible], line_profiles, half=half
+                ))
+    return patterns
+
+
+def sweep_indices(
+        scales: np.ndarray, num_layer_lines: int = 4,
+        out: Optional[np.ndarray] = None
+        ) -> np.ndarray:
+    '''layer line profiles of every tube in indices.csv at every scale
+
+    Returns float32 of shape (len(scales), tubes, lines, RESOLUTION).
+    '''
+    chiral_n, chiral_m, _ = load_indices()
+    return batch_layer_lines(chiral_n, chiral_m,
+                             np.asarray(scales, dtype=float)[:, None],
+                             num_layer_lines, out)
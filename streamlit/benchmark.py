@@ -0,0 +1,195 @@
+'''Headless benchmarks of the simulator and rendering hot paths
+
+    python benchmark.py --output baseline.json
+    python benchmark.py --compare baseline.json
+
+times diffract_plot over a grid of chiralities, scales, layer lines, l0
+and intensity modes, the Bessel tables of the layer lines, the Contrast
+log transform and the render step, without running the app. Results are
+written as JSON; --compare exits with status 1 if any case got slower
+than --threshold times its baseline, so it can gate a deployment.
+'''
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional
+import argparse
+import itertools
+import json
+import platform
+import sys
+import time
+import numpy as np
+import scipy
+import cache
+from bessel import bessel_table
+from core import bessel_orders, chiralIndices, clear_layer_lines, \
+        diffract_plot, factor_lookup, intensity_transform, \
+        layer_line_profiles, radial_axis
+from mixture import mixture_pattern
+from render import render, to_image
+
+
+CHIRALITIES: List[chiralIndices] = [
+        chiralIndices(10, 0), chiralIndices(5, 5), chiralIndices(20, 3),
+        chiralIndices(30, 25)]
+SCALES: List[float] = [1.0, 10.0, 50.0]
+NUM_LAYER_LINES: List[int] = [1, 3, 4, 20]
+LINES: List[str] = ['Yes', 'No']
+OPTIONS: List[str] = ['Linear', 'Contrast']
+# default slowdown over the baseline that counts as a regression
+THRESHOLD: float = 1.25
+
+
+class Case(NamedTuple):
+    name: str
+    run: Callable[[], object]
+    # untimed, before every run
+    setup: Callable[[], None] = lambda: None
+
+
+def clear_caches() -> None:
+    '''drop the pattern and layer line caches, so a run starts cold'''
+    cache.clear()
+    clear_layer_lines()
+
+
+def simulation_cases() -> Iterator[Case]:
+    for indices, scale, num, lines, option in itertools.product(
+            CHIRALITIES, SCALES, NUM_LAYER_LINES, LINES, OPTIONS):
+        factor = int(factor_lookup(indices.n, indices.m))
+        yield Case(
+                f'diffract_plot/{indices.n},{indices.m}/scale={scale}/'
+                f'num_layer_lines={num}/lines={lines}/{option}',
+                lambda i=indices, s=scale, k=num, y=lines, o=option, f=factor:
+                    diffract_plot(i.n, i.m, k, s, o, y, f),
+                clear_caches
+                )
+
+
+def mixture_cases() -> Iterator[Case]:
+    '''the whole bundle of CHIRALITIES, simulated or from cached tubes'''
+    tubes = [(indices.n, indices.m) for indices in CHIRALITIES]
+    fractions = np.ones(len(tubes))
+    for option in OPTIONS:
+        run = (lambda o=option: mixture_pattern(tubes, fractions, 3, 10.0, o,
+                                                'Yes'))
+        yield Case(f'mixture_pattern/{len(tubes)} tubes/{option}', run,
+                   clear_caches)
+        yield Case(f'mixture_pattern/{len(tubes)} tubes/{option}/cached',
+                   run)
+
+
+def bessel_cases() -> Iterator[Case]:
+    '''every order of a tube's layer lines from one bessel_table pass,
+    and the cached |J|^2 profiles diffract_plot takes them from, cold'''
+    for indices, scale, num in itertools.product(CHIRALITIES, SCALES,
+                                                 (4, 20)):
+        radius_spacing = radial_axis(indices, scale, half=True)
+        max_order = max(bessel_orders(indices, num))
+        yield Case(f'bessel_table/{indices.n},{indices.m}/scale={scale}/'
+                   f'max_order={max_order}',
+                   lambda k=max_order, r=radius_spacing: bessel_table(k, r))
+        yield Case(f'layer_line_profiles/{indices.n},{indices.m}/'
+                   f'scale={scale}/num_layer_lines={num}',
+                   lambda i=indices, s=scale, k=num: layer_line_profiles(
+                           i.n, i.m, s, True, k),
+                   clear_caches)
+
+
+def transform_cases(mesh: np.ndarray) -> Iterator[Case]:
+    profiles = np.ascontiguousarray(mesh[mesh.any(axis=1)])
+    yield Case('intensity_transform/Contrast/dense',
+               lambda: intensity_transform(mesh, 'Contrast'))
+    yield Case('intensity_transform/Contrast/layer_lines',
+               lambda: intensity_transform(profiles, 'Contrast'))
+
+
+def render_cases(mesh: np.ndarray) -> Iterator[Case]:
+    yield Case('render/to_image', lambda: to_image(mesh))
+    yield Case('render/png', lambda: render(mesh, image_format='PNG'))
+    yield Case('render/webp', lambda: render(mesh, image_format='WEBP'))
+
+
+def all_cases() -> List[Case]:
+    indices = chiralIndices(20, 3)
+    factor = int(factor_lookup(indices.n, indices.m))
+    _, _, mesh = diffract_plot(indices.n, indices.m, 3, 10.0, 'Linear',
+                               'Yes', factor)
+    _, _, contrast = diffract_plot(indices.n, indices.m, 3, 10.0,
+                                   'Contrast', 'Yes', factor)
+    return [*simulation_cases(), *mixture_cases(), *bessel_cases(),
+            *transform_cases(mesh), *render_cases(contrast)]
+
+
+def time_case(case: Case, repeats: int) -> Dict[str, float]:
+    '''min and median seconds of repeats runs, after one warm-up run'''
+    case.setup()
+    case.run()
+    times = []
+    for _ in range(repeats):
+        case.setup()
+        start = time.perf_counter()
+        case.run()
+        times.append(time.perf_counter() - start)
+    return {'min': min(times), 'median': float(np.median(times))}
+
+
+def environment() -> Dict[str, str]:
+    '''what the timings depend on, stored next to them'''
+    return {'python': platform.python_version(),
+            'numpy': np.__version__,
+            'scipy': scipy.__version__,
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'system': platform.platform()}
+
+
+def run_benchmarks(
+        repeats: int = 5, pattern: Optional[str] = None
+        ) -> Dict[str, object]:
+    results = {case.name: time_case(case, repeats) for case in all_cases()
+               if pattern is None or pattern in case.name}
+    return {'environment': environment(), 'repeats': repeats,
+            'results': results}
+
+
+def regressions(
+        current: Dict[str, object], baseline: Dict[str, object],
+        threshold: float = THRESHOLD
+        ) -> Dict[str, float]:
+    '''current/baseline min time of every case over threshold'''
+    ratios = {name: timing['min']/baseline['results'][name]['min']
+              for name, timing in current['results'].items()
+              if name in baseline['results']}
+    return {name: ratio for name, ratio in ratios.items()
+            if ratio > threshold}
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--filter', default=None,
+                        help='only cases whose name contains this')
+    parser.add_argument('--output', default=None,
+                        help='write the results to this JSON file')
+    parser.add_argument('--compare', default=None,
+                        help='baseline JSON file to check against')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD)
+    args = parser.parse_args(argv)
+
+    current = run_benchmarks(args.repeats, args.filter)
+    for name, timing in current['results'].items():
+        print(f"{timing['min']*1000:10.3f} ms  {name}")
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=1)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        slower = regressions(current, baseline, args.threshold)
+        for name, ratio in sorted(slower.items(), key=lambda x: -x[1]):
+            print(f'{ratio:6.2f}x slower  {name}')
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+'''J_0...J_N on a shared argument grid in one recurrence pass
+
+scipy.special.jv evaluates every order independently, so a tube's five
+layer lines cost five special function evaluations per point. Here J_0
+and J_1 come from scipy.special.j0/j1 and the higher orders from the
+forward recurrence J_k+1 = 2k/x J_k - J_k-1, which is stable while
+k <= |x|. Arguments with |x| < N, where it is not, are redone with
+Miller's backward recurrence, started well above N and normalised with
+J_0 + 2(J_2 + J_4 + ...) = 1.
+'''
+from typing import Optional, Sequence, Tuple
+import numpy as np
+
+
+# Miller start order above N is sqrt(MILLER_ACCURACY*N), cf. bessj in
+# Numerical Recipes
+MILLER_ACCURACY: int = 160
+# backward recurrence values are rescaled beyond this to avoid overflow
+RESCALE: float = 1e150
+
+
+def miller_start(max_order: int) -> int:
+    '''even order the backward recurrence starts from'''
+    start = max_order + int(np.sqrt(MILLER_ACCURACY*max_order)) + 10
+    return start + start % 2
+
+
+def _miller(max_order: int, x: np.ndarray) -> np.ndarray:
+    '''(max_order+1, len(x)) J_k of nonzero x by backward recurrence'''
+    table = np.zeros((max_order+1, len(x)))
+    two_over_x = 2.0/x
+    current, upper = np.ones_like(x), np.zeros_like(x)  # J_k, J_k+1
+    # J_0 + 2*(J_2 + J_4 + ...), start is even
+    norm = np.full_like(x, 2.0)
+    for k in range(miller_start(max_order), 0, -1):
+        current, upper = k*two_over_x*current - upper, current
+        big = np.abs(current) > RESCALE
+        if big.any():
+            current[big] /= RESCALE
+            upper[big] /= RESCALE
+            norm[big] /= RESCALE
+            table[k:, big] /= RESCALE
+        if k-1 <= max_order:
+            table[k-1] = current
+        if k-1 > 0 and (k-1) % 2 == 0:
+            norm += 2*current
+    norm += current
+    table /= norm
+    return table
+
+
+def bessel_table(
+        max_order: int, x: np.ndarray, out: Optional[np.ndarray] = None
+        ) -> np.ndarray:
+    '''J_0(x)...J_max_order(x), float64 of shape (max_order+1,) + x.shape'''
+    # imported here, scipy.special is slow to import and only needed once
+    # a table is computed
+    from scipy.special import j0, j1
+
+    x = np.asarray(x, dtype=float)
+    shape = (max_order+1,) + x.shape
+    if out is None:
+        out = np.empty(shape)
+    elif out.shape != shape or out.dtype != np.float64:
+        raise ValueError(
+                f'out must be float64 with shape {shape}, '
+                f'got {out.dtype} with shape {out.shape}'
+                )
+    j0(x, out=out[0])
+    if max_order == 0:
+        return out
+    j1(x, out=out[1])
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        two_over_x = 2.0/x
+        for k in range(1, max_order):
+            np.multiply(k*two_over_x, out[k], out=out[k+1])
+            out[k+1] -= out[k-1]
+
+    # forward recurrence is unstable above |x|, redo those arguments
+    small = np.abs(x) < max_order
+    if small.any():
+        zero = x == 0.0
+        nonzero = small & ~zero
+        if nonzero.any():
+            out[:, nonzero] = _miller(max_order, x[nonzero])
+        out[1:, zero] = 0.0
+    return out
+
+
+def multi_order_jv(orders: Sequence[int], x: np.ndarray
+                   ) -> Tuple[np.ndarray, ...]:
+    '''J_order(x) of non-negative orders, views into one bessel_table'''
+    orders = [int(order) for order in orders]
+    if min(orders) < 0:
+        raise ValueError(f'orders must be non-negative, got {orders}')
+    table = bessel_table(max(orders), x)
+    return tuple(table[order] for order in orders)
@@ -0,0 +1,312 @@
+'''Pluggable result cache of the simulation core
+
+Functions decorated with @cached share one process-wide backend:
+
+- NoCache: every call computes,
+- LRUCache: the most recently used results in memory (the default),
+- DiskCache: results in a directory shared by processes (e.g. app
+  replicas and restarts), arrays memory-mapped, bounded in size,
+- TieredCache: an LRUCache in front of a DiskCache ('lru+disk').
+
+It is chosen with set_backend(), or on first use from the environment:
+CNT_CACHE=none|lru|disk|lru+disk, CNT_CACHE_SIZE (entries of the LRU
+cache), CNT_CACHE_DIR and CNT_CACHE_BYTES (of the disk cache). Keys are
+digests of the function's qualified name and its bound arguments, so a
+result is found again whether arguments were passed by position or by
+keyword, and the disk cache is content-addressed by them.
+'''
+from typing import Any, BinaryIO, Callable, Dict, List, Optional, Tuple
+from collections import OrderedDict
+from pathlib import Path
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import metrics
+
+
+# results the default in-process cache holds
+CACHE_SIZE: int = 256
+# default directory of the disk cache, and the size it is kept under
+CACHE_DIR: Path = Path(tempfile.gettempdir()) / 'cnt-cache'
+CACHE_BYTES: int = 2**30
+# returned by get() for a key that is not cached
+MISSING = object()
+
+
+class NoCache:
+    '''never stores anything'''
+
+    def get(self, key: str) -> Any:
+        return MISSING
+
+    def set(self, key: str, value: Any) -> None:
+        pass
+
+    def clear(self) -> None:
+        pass
+
+
+class LRUCache:
+    '''maxsize most recently used results, in memory'''
+
+    def __init__(self, maxsize: int = CACHE_SIZE):
+        self.maxsize = maxsize
+        self._values: 'OrderedDict[str, Any]' = OrderedDict()
+        # reruns of several app sessions run on their own threads
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            if key not in self._values:
+                return MISSING
+            self._values.move_to_end(key)
+            return self._values[key]
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._values[key] = value
+            self._values.move_to_end(key)
+            while len(self._values) > self.maxsize:
+                self._values.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+
+class _EntryPickler(pickle.Pickler):
+    '''pickles a value with its numpy arrays saved as .npy files'''
+
+    def __init__(self, f: BinaryIO, directory: Path):
+        super().__init__(f, protocol=pickle.HIGHEST_PROTOCOL)
+        self.directory = directory
+        self.arrays = 0
+
+    def persistent_id(self, obj: Any) -> Optional[str]:
+        import numpy as np
+        if type(obj) is not np.ndarray or obj.dtype.hasobject:
+            return None
+        name = f'{self.arrays}.npy'
+        self.arrays += 1
+        np.save(self.directory / name, obj)
+        return name
+
+
+class _EntryUnpickler(pickle.Unpickler):
+    '''loads a value with its arrays memory-mapped, read-only'''
+
+    def __init__(self, f: BinaryIO, directory: Path):
+        super().__init__(f)
+        self.directory = directory
+
+    def persistent_load(self, name: str) -> Any:
+        import numpy as np
+        return np.load(self.directory / name, mmap_mode='r')
+
+
+class DiskCache:
+    '''results in directory, shared by processes, at most max_bytes
+
+    Every entry is a directory named by its key, holding the pickled
+    value with its numpy arrays as .npy files, which are memory-mapped
+    (read-only) when loaded. Entries are written under a temporary name
+    and renamed into place, so readers never see a partial one and
+    concurrent writers of a key (which write the same content) do not
+    clash. Reading an entry marks it as used; once the directory grows
+    past max_bytes the least recently used entries are removed.
+    '''
+
+    def __init__(self, directory: Path = CACHE_DIR,
+                 max_bytes: int = CACHE_BYTES):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # estimate of the directory's size, rescanned before evicting,
+        # as other processes add and remove entries too
+        self._bytes: Optional[int] = None
+
+    def get(self, key: str) -> Any:
+        entry = self.directory / key
+        try:
+            with open(entry / 'value.pkl', 'rb') as f:
+                value = _EntryUnpickler(f, entry).load()
+            os.utime(entry)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            # not cached, or evicted while being read
+            return MISSING
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        entry = Path(tempfile.mkdtemp(dir=self.directory, prefix='.tmp-'))
+        try:
+            with open(entry / 'value.pkl', 'wb') as f:
+                _EntryPickler(f, entry).dump(value)
+            size = sum(f.stat().st_size for f in entry.iterdir())
+            os.replace(entry, self.directory / key)
+        except OSError:
+            # another process stored the key first
+            shutil.rmtree(entry, ignore_errors=True)
+            return
+        if self._bytes is None:
+            self._bytes = sum(size for _, size, _ in self.entries())
+        else:
+            self._bytes += size
+        if self._bytes > self.max_bytes:
+            self.evict()
+
+    def entries(self) -> List[Tuple[float, int, Path]]:
+        '''(last use, bytes, path) of every entry'''
+        entries = []
+        for entry in self.directory.iterdir():
+            if entry.name.startswith('.'):
+                continue
+            try:
+                size = sum(f.stat().st_size for f in entry.iterdir())
+                entries.append((entry.stat().st_mtime, size, entry))
+            except FileNotFoundError:
+                continue
+        return entries
+
+    def evict(self) -> None:
+        '''remove the least recently used entries beyond max_bytes'''
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in entries:
+            if total <= self.max_bytes:
+                break
+            self._remove(entry)
+            total -= size
+        self._bytes = total
+
+    def _remove(self, entry: Path) -> None:
+        # renamed away first, so it disappears from readers at once
+        trash = Path(tempfile.mkdtemp(dir=self.directory, prefix='.del-'))
+        try:
+            os.replace(entry, trash / entry.name)
+        except FileNotFoundError:
+            pass
+        shutil.rmtree(trash, ignore_errors=True)
+
+    def clear(self) -> None:
+        for entry in self.directory.iterdir():
+            if not entry.name.startswith('.'):
+                self._remove(entry)
+        self._bytes = 0
+
+
+class TieredCache:
+    '''a fast cache in front of a slower, larger one (e.g. LRUCache in
+    front of DiskCache): hits of the slow one are kept in the fast one'''
+
+    def __init__(self, fast: Any, slow: Any):
+        self.fast = fast
+        self.slow = slow
+
+    def get(self, key: str) -> Any:
+        value = self.fast.get(key)
+        if value is MISSING:
+            value = self.slow.get(key)
+            if value is not MISSING:
+                self.fast.set(key, value)
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        self.slow.set(key, value)
+        self.fast.set(key, value)
+
+    def clear(self) -> None:
+        self.fast.clear()
+        self.slow.clear()
+
+
+def _lru() -> LRUCache:
+    return LRUCache(int(os.environ.get('CNT_CACHE_SIZE', CACHE_SIZE)))
+
+
+def _disk() -> DiskCache:
+    return DiskCache(Path(os.environ.get('CNT_CACHE_DIR', CACHE_DIR)),
+                     int(os.environ.get('CNT_CACHE_BYTES', CACHE_BYTES)))
+
+
+BACKENDS: Dict[str, Callable[[], Any]] = {
+    'none': NoCache,
+    'lru': _lru,
+    'disk': _disk,
+    'lru+disk': lambda: TieredCache(_lru(), _disk()),
+}
+_backend = None
+
+
+def set_backend(backend: Any) -> None:
+    '''backend of every @cached function from now on, e.g. LRUCache()'''
+    global _backend
+    _backend = backend
+
+
+def get_backend() -> Any:
+    '''the current backend, made from $CNT_CACHE on first use'''
+    global _backend
+    if _backend is None:
+        name = os.environ.get('CNT_CACHE', 'lru')
+        if name not in BACKENDS:
+            raise ValueError(
+                    f'CNT_CACHE must be one of {sorted(BACKENDS)}, got '
+                    f'{name!r}'
+                    )
+        _backend = BACKENDS[name]()
+    return _backend
+
+
+def cache_key(name: str, arguments: Dict[str, Any]) -> str:
+    '''digest of a function name and its bound arguments'''
+    # numpy scalars as the Python numbers they hold
+    arguments = {key: value.item() if getattr(value, 'ndim', None) == 0
+                 else value for key, value in arguments.items()}
+    return hashlib.sha256(
+            repr((name, sorted(arguments.items()))).encode()
+            ).hexdigest()
+
+
+def cached(function: Callable) -> Callable:
+    '''cache function's results in the current backend
+
+    Arguments must have a repr that identifies them (numbers, strings,
+    tuples of them); results should not be mutated by callers.
+    '''
+    name = f'{function.__module__}.{function.__qualname__}'
+    # metrics stages: computing a result, looking it up, and counters
+    stage = f'{function.__module__}/{function.__qualname__}'
+    lookup, hit, miss = f'{stage}/lookup', f'{stage}/hit', f'{stage}/miss'
+    signature = inspect.signature(function)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        backend = get_backend()
+        if isinstance(backend, NoCache):
+            return function(*args, **kwargs)
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        key = cache_key(name, bound.arguments)
+        with metrics.timer(lookup):
+            value = backend.get(key)
+        if value is MISSING:
+            metrics.count(miss)
+            with metrics.timer(stage):
+                value = function(*args, **kwargs)
+            backend.set(key, value)
+        else:
+            metrics.count(hit)
+        return value
+
+    wrapper.uncached = function
+    return wrapper
+
+
+def clear() -> None:
+    '''drop every result of the current backend'''
+    get_backend().clear()
@@ -0,0 +1,348 @@
+'''Diffraction physics of single tubes, without Streamlit
+
+Everything the app, the batch jobs and their worker processes simulate
+comes from here. Importing it only loads numpy; scipy is imported once a
+Bessel function is evaluated. diffract_pattern results are kept by the
+backend of cache.py (in-process LRU by default, or none, or on disk),
+which helper.py and the app share.
+'''
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+from functools import lru_cache
+from pathlib import Path
+import numpy as np
+from numpy import errstate, isneginf
+from bessel import bessel_table
+from cache import MISSING, LRUCache, cached
+import metrics
+from layer_lines import layer_line_orders, layer_line_spacings, \
+        reflections
+from pattern import BAND_WIDTH, LayerLinePattern
+
+
+# global a0 length
+BASIS_A0: int = 0.246  # nm
+# |J|^2 layer line profiles kept, one per tube, scale and Bessel order
+LAYER_LINE_CACHE_SIZE: int = 1024
+# calibrated (n, m, spacing factor) rows
+INDICES_CSV: Path = Path(__file__).with_name('indices.csv')
+# factor_table sizes are multiples of this
+FACTOR_BLOCK: int = 64
+# points of the radial axis and rows of the mesh of diffract_plot; other
+# resolutions scale its band widths and row positions
+RESOLUTION: int = 1000
+
+# |J|^2 layer line profiles by 'n,m,scale,half,resolution,order'
+_layer_lines = LRUCache(LAYER_LINE_CACHE_SIZE)
+
+
+class chiralIndices(NamedTuple):
+    n: int
+    m: int
+
+
+def chiralAngle(chiralIndices: NamedTuple) -> float:
+    return np.arctan(np.sqrt(3)*chiralIndices.m /
+                     (2*chiralIndices.n + chiralIndices.m))
+
+
+def diameter(chiralIndices: NamedTuple) -> float:
+    return BASIS_A0/np.pi * np.sqrt(chiralIndices.n**2
+                                    + chiralIndices.m**2
+                                    + chiralIndices.n*chiralIndices.m)
+
+
+def spacingD1(angle: float, astar: float) -> float:
+    '''spacing for l1 pattern from R=0'''
+    return astar*np.cos(angle)
+
+
+def spacingD2(angle: float, astar: float) -> float:
+    '''spacing for l2 pattern from R=0'''
+    return astar*np.cos((60*np.pi/180) - angle)
+
+
+def spacingD3(angle: float, astar: float) -> float:
+    '''spacing for l3 pattern from R=0'''
+    return astar*np.cos((60*np.pi/180) + angle)
+
+
+def spacingD4(angle: float, astar: float) -> float:
+    '''spacing for l4 pattern from R=0'''
+    return np.sqrt(3)*astar*np.cos((30*np.pi/180) - angle)
+
+
+def _jv(order: int, x: np.ndarray) -> np.ndarray:
+    '''scipy.special.jv, which is slow to import, imported on first use'''
+    from scipy.special import jv
+    return jv(order, x)
+
+
+def l0_mesh(
+        chiralIndices: NamedTuple, radius_spacing: np.ndarray
+        ) -> np.ndarray:
+    '''2D mesh of values for l0'''
+    return np.abs(_jv(0, radius_spacing))**2
+
+
+def l1_mesh(
+        chiralIndices: NamedTuple, radius_spacing: np.ndarray
+        ) -> np.ndarray:
+    '''2D mesh of values for l1'''
+    return np.abs(_jv(chiralIndices.m, radius_spacing))**2
+
+
+def l2_mesh(
+        chiralIndices: NamedTuple, radius_spacing: np.ndarray
+        ) -> np.ndarray:
+    '''2D mesh of values for l2'''
+    return np.abs(_jv(chiralIndices.n, radius_spacing))**2
+
+
+def l3_mesh(
+        chiralIndices: NamedTuple, radius_spacing: np.ndarray
+        ) -> np.ndarray:
+    '''2D mesh of values for l3'''
+    return np.abs(_jv(chiralIndices.n + chiralIndices.m, radius_spacing))**2
+
+
+def l4_mesh(
+        chiralIndices: NamedTuple, radius_spacing: np.ndarray
+        ) -> np.ndarray:
+    '''2D mesh of values for l4'''
+    return np.abs(_jv(chiralIndices.n - chiralIndices.m, radius_spacing))**2
+
+
+def spacing_factor(chiral_n: np.ndarray, chiral_m: np.ndarray
+                   ) -> np.ndarray:
+    '''closed-form layer line spacing factor, cf. eqn. (70) in Qin 2006.
+
+    pi*d*a*/a0 with a* = 2/(sqrt(3)*a0) converts the spacings (given in
+    units of a0) to the Bessel argument axis of diffract_plot.
+    '''
+    d = BASIS_A0/np.pi * np.sqrt(np.square(chiral_n) + np.square(chiral_m)
+                                 + np.multiply(chiral_n, chiral_m))
+    return np.pi*d*2/(np.sqrt(3)*BASIS_A0**2)
+
+
+@lru_cache(maxsize=None)
+def factor_table(size: int) -> np.ndarray:
+    '''dense spacing factor table indexed [min(n, m), max(n, m)] < size
+
+    The calibrated factors of indices.csv where they exist. Beyond them,
+    spacing_factor times the calibration (factor / spacing_factor) of the
+    nearest calibrated tube, (min(n, m, top), min(max(n, m), top)) with
+    top the largest calibrated index, so the table is continuous at the
+    edge of the calibration.
+    '''
+    key_value = np.loadtxt(INDICES_CSV, delimiter=',', ndmin=2).astype(int)
+    low, high = key_value[:, :2].min(axis=1), key_value[:, :2].max(axis=1)
+    top = int(high.max())
+    # tubes missing from indices.csv, and (0, 0), keep the closed form
+    calibration = np.ones((top+1, top+1))
+    with errstate(divide='ignore', invalid='ignore'):
+        ratio = key_value[:, 2]/spacing_factor(high, low)
+    calibration[low, high] = np.where(np.isfinite(ratio), ratio, 1.0)
+    low, high = np.indices((size, size))
+    table = np.rint(
+            spacing_factor(high, low)
+            * calibration[np.minimum(low, top), np.minimum(high, top)]
+            ).astype(int)
+    table.flags.writeable = False
+    return table
+
+
+def factor_lookup(chiral_n: np.ndarray, chiral_m: np.ndarray) -> np.ndarray:
+    '''spacing factor of (n, m), for scalars or arrays in either order'''
+    with metrics.timer('core/factor_lookup'):
+        low = np.minimum(chiral_n, chiral_m)
+        high = np.maximum(chiral_n, chiral_m)
+        # tables grow lazily in blocks, each built once
+        size = (int(np.max(high))//FACTOR_BLOCK + 1)*FACTOR_BLOCK
+        return factor_table(size)[low, high]
+
+
+def radial_axis(
+        chiralIndices: NamedTuple, scale: float, half: bool = False,
+        resolution: int = RESOLUTION
+        ) -> np.ndarray:
+    '''radial (Bessel argument) axis of the plot, resolution points over
+    -d...d, or only its resolution//2 points over 0...d with half'''
+    diameter_mesh = np.linspace(-diameter(chiralIndices),
+                                diameter(chiralIndices), resolution)  # nm
+    if half:
+        diameter_mesh = diameter_mesh[resolution//2:]
+    return np.pi*diameter_mesh*scale
+
+
+def bessel_orders(
+        chiralIndices: NamedTuple, num_layer_lines: int = 4
+        ) -> Tuple[int, ...]:
+    '''Bessel orders of layer lines l0...l_num_layer_lines, see
+    layer_lines; l0...l4 in the same order as l*_mesh'''
+    # |J_-k|^2 == |J_k|^2 for integer k, so orders are taken positive
+    return tuple(int(order) for order in layer_line_orders(
+            reflections(num_layer_lines), chiralIndices.n, chiralIndices.m
+            ))
+
+
+def layer_line_profiles(
+        chiral_n: int, chiral_m: int, scale: float, half: bool = False,
+        num_layer_lines: int = 4, resolution: int = RESOLUTION
+        ) -> Dict[int, np.ndarray]:
+    '''raw |J_order|^2 profile along the radial axis of every order in
+    bessel_orders (cached per order, read-only)
+
+    The orders not cached yet come from one bessel_table pass. Profiles
+    are shared by every intensity mode, layer line toggle and number of
+    layer lines, so changing the display only re-runs the cheap
+    transforms in diffract_plot, and adding a layer line only evaluates
+    its new orders.
+    '''
+    indices = chiralIndices(chiral_n, chiral_m)
+    orders = sorted(set(bessel_orders(indices, num_layer_lines)))
+    tube = f'{chiral_n},{chiral_m},{scale!r},{half},{resolution}'
+    profiles = {order: _layer_lines.get(f'{tube},{order}')
+                for order in orders}
+    missing = [order for order in orders if profiles[order] is MISSING]
+    if missing:
+        with metrics.timer('core/bessel'):
+            table = bessel_table(missing[-1], radial_axis(indices, scale,
+                                                          half, resolution))
+        for order in missing:
+            profile = np.square(table[order])
+            profile.flags.writeable = False
+            _layer_lines.set(f'{tube},{order}', profile)
+            profiles[order] = profile
+    return profiles
+
+
+def clear_layer_lines() -> None:
+    '''drop every cached layer line profile'''
+    _layer_lines.clear()
+
+
+def top_hat(layer_line: np.ndarray, max_intensity: float) -> np.ndarray:
+    '''clip a layer line at max_intensity so it does not dominate'''
+    return np.minimum(layer_line, max_intensity)
+
+
+def layer_line_rows(
+        positions: np.ndarray, diffraction_distance: np.ndarray,
+        resolution: int = RESOLUTION
+        ) -> Tuple[np.ndarray, np.ndarray]:
+    '''(positive, negative) rows of layer lines at positions on a mesh of
+    resolution rows, centered'''
+    center = resolution//2
+    pos_rows = np.floor(center*positions/diffraction_distance+center)
+    neg_rows = -np.floor(center*positions/diffraction_distance-center)
+    return pos_rows.astype(int), neg_rows.astype(int)
+
+
+def visible_layer_lines(
+        pos_rows: np.ndarray, line_profiles: Sequence[np.ndarray],
+        lines: str, resolution: int = RESOLUTION
+        ) -> Tuple[List[int], np.ndarray]:
+    '''(drawn lines, their float profiles) of l0...l_num, given the rows
+    and profiles of every line: l1...l_num that are on the plot, then l0
+    top hatted with lines == 'Yes'
+    '''
+    # if not, scale is too 'zoomed in' to appear on plot, do nothing
+    margin = 2*resolution//RESOLUTION
+    visible = [i for i in range(1, len(pos_rows))
+               if pos_rows[i]+margin <= resolution]
+    profiles = [line_profiles[i] for i in visible]
+    max_intensity = max((np.max(p) for p in profiles), default=0.0)
+
+    # include center lines
+    if lines == 'Yes':
+        # top hat function so intensity does not dominate
+        profiles.append(top_hat(line_profiles[0], max_intensity))
+        visible.append(0)
+    return visible, np.array(profiles, dtype=float).reshape(
+            -1, len(line_profiles[0]))
+
+
+def intensity_transform(total_mesh: np.ndarray, option: str) -> np.ndarray:
+    '''map raw intensities to the 'Linear' or 'Contrast' display mode'''
+    if option == 'Contrast':
+        with metrics.timer('core/log10'), errstate(divide='ignore'):
+            total_mesh = np.log10(total_mesh)
+            total_mesh[isneginf(total_mesh)] = 0.0
+    return total_mesh
+
+
+@cached
+def diffract_pattern(
+        chiral_n: int, chiral_m: int, num_layer_lines: int,
+        scale: float, option: str, lines: str, factor: int,
+        half: bool = False, resolution: int = RESOLUTION
+        ) -> LayerLinePattern:
+    '''layer lines of the diffraction pattern, without the dense mesh
+    (cached, read-only)
+
+    With half, only the x >= 0 half of the radial axis is evaluated (the
+    pattern is mirror-symmetric), see LayerLinePattern. Other resolutions
+    than RESOLUTION (even ones) draw the same pattern on a finer or
+    coarser mesh.
+    '''
+    # define indices from user input
+    indices = chiralIndices(chiral_n, chiral_m)
+    # diameter of carbon nanotube
+    d = diameter(indices)
+    # chiral angle of carbon nanotube
+    angle = chiralAngle(indices)
+
+    radius_spacing = radial_axis(indices, scale, half, resolution)
+
+    astar = BASIS_A0  # BASIS_A0
+    diffraction_distance = np.pi*d*scale/factor
+
+    # Bessel order and spacing in nm of l0...l_num, see layer_lines
+    hk = reflections(num_layer_lines)
+    orders = layer_line_orders(hk, chiral_n, chiral_m)
+    positions = layer_line_spacings(hk, angle, astar)
+
+    pos_position_slices, neg_position_slices = layer_line_rows(
+            positions, diffraction_distance, resolution
+            )
+
+    # every order from one pass; up to l4 shared with the usual toggles
+    line_profiles = layer_line_profiles(chiral_n, chiral_m, scale, half,
+                                        max(num_layer_lines, 4), resolution)
+    visible, profiles = visible_layer_lines(
+            pos_position_slices, [line_profiles[order] for order in orders],
+            lines, resolution
+            )
+
+    # if logarithmic; empty mesh rows stay 0.0 in both modes
+    profiles = intensity_transform(profiles, option)
+
+    # bands as wide, relative to the mesh, as at RESOLUTION
+    band_width = max(BAND_WIDTH*resolution//RESOLUTION, 2)
+    pattern = LayerLinePattern(radius_spacing, pos_position_slices[visible],
+                               neg_position_slices[visible], profiles,
+                               band_width, half)
+    # shared by every caller through the cache
+    for array in pattern[:4]:
+        array.flags.writeable = False
+    return pattern
+
+
+def diffract_plot(
+        chiral_n: int, chiral_m: int, num_layer_lines: int,
+        scale: float, option: str, lines: str, factor: int,
+        out: Optional[np.ndarray] = None
+        ) -> np.ndarray:
+    '''(radius_spacing, diffraction_spacing, mesh) of the pattern
+
+    Only one quadrant is simulated and assembled; it is mirrored into out
+    when given, so repeated calls can reuse one (1000, 1000) buffer.
+    '''
+    pattern = diffract_pattern(
+            chiral_n, chiral_m, num_layer_lines, scale, option, lines,
+            factor, half=True
+            )
+    radius_spacing = radial_axis(chiralIndices(chiral_n, chiral_m), scale)
+    diffraction_spacing = radius_spacing.copy()
+    with metrics.timer('core/dense'):
+        return radius_spacing, diffraction_spacing, pattern.dense(out)
@@ -0,0 +1,190 @@
+'''Generate the deep_learning.ipynb training set from the simulator
+
+    python generate_dataset.py OUT_DIR --samples 100000 --workers 8
+
+Samples are drawn reproducibly (from --seed) over the chiralities in
+indices.csv, a grid of scales and mixtures of up to MAX_TUBES tubes with
+fractions on a grid of 1/--fraction-steps. Shards are written by a
+process pool as OUT_DIR/shard_*.npy, float32 arrays of SAMPLE_WIDTH
+columns in the layout the notebook reads (np.load(..., mmap_mode='r')
+maps them without reading), and OUT_DIR/index.json holds the label index
+(the (n, m) of every class id) and the shard list.
+'''
+from typing import Dict, List, Optional, Tuple
+from functools import lru_cache
+from pathlib import Path
+import argparse
+import itertools
+import json
+import multiprocessing
+import numpy as np
+from batch import INDICES_CSV
+from mixture import ProfileBank
+from pattern import PROFILE_LENGTH
+
+
+# columns per sample, X_length in deep_learning.ipynb
+SAMPLE_WIDTH: int = PROFILE_LENGTH + 10
+MAX_TUBES: int = 3
+# trailing columns, negative indices as read by deep_learning.ipynb
+SCALE_COLUMN: int = -10
+CLASS_COLUMNS: slice = slice(-7, -4)  # y_1...y_3, -1 for an empty slot
+FRACTION_COLUMNS: slice = slice(-4, -1)  # A_1...A_3, largest first
+TUBES_COLUMN: int = -1  # number of tubes - 1
+# samples mixed at once, bounds the gathered profile temporaries
+MIX_CHUNK_SIZE: int = 1024
+
+
+def chirality_classes(path: Path = INDICES_CSV) -> np.ndarray:
+    '''unique (n, m, factor) rows of indices.csv; the row is the class id'''
+    key_value = np.loadtxt(path, delimiter=',', ndmin=2).astype(int)
+    _, first = np.unique(key_value[:, :2], axis=0, return_index=True)
+    return key_value[np.sort(first)]
+
+
+def fraction_grid(tubes: int, steps: int) -> np.ndarray:
+    '''every split of 1 into tubes multiples of 1/steps, largest first'''
+    splits = {tuple(sorted(np.diff((0,) + cuts + (steps,)), reverse=True))
+              for cuts in itertools.combinations(range(1, steps), tubes-1)}
+    return np.array(sorted(splits), dtype=float) / steps
+
+
+def sample_specs(
+        num_samples: int, num_classes: int, scales: np.ndarray,
+        max_tubes: int = MAX_TUBES, fraction_steps: int = 12, seed: int = 0
+        ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    '''(class ids, fractions, scale) of every sample, from seed alone'''
+    rng = np.random.default_rng(seed)
+    classes = np.full((num_samples, MAX_TUBES), -1)
+    fractions = np.zeros((num_samples, MAX_TUBES))
+    tubes = rng.integers(1, max_tubes+1, num_samples)
+    grids = {k: fraction_grid(k, fraction_steps)
+             for k in range(1, max_tubes+1)}
+    for i, k in enumerate(tubes):
+        classes[i, :k] = rng.choice(num_classes, k, replace=False)
+        fractions[i, :k] = grids[k][rng.integers(len(grids[k]))]
+    scale = rng.choice(scales, num_samples)
+    return classes, fractions, scale
+
+
+def render_samples(
+        classes: np.ndarray, fractions: np.ndarray, scale: np.ndarray,
+        bank: ProfileBank, out: np.ndarray
+        ) -> np.ndarray:
+    '''fill out (samples, SAMPLE_WIDTH) with the mixed, normalised profiles
+
+    Each (class, scale) is simulated once per bank, the samples are
+    weighted sums of its profiles.
+    '''
+    scale_index = bank.scale_index(scale)
+    for start in range(0, len(scale), MIX_CHUNK_SIZE):
+        rows = slice(start, start+MIX_CHUNK_SIZE)
+        mixed = bank.mix(classes[rows], fractions[rows], scale_index[rows])
+        peak = mixed.max(axis=1, keepdims=True)
+        out[rows, :PROFILE_LENGTH] = mixed/np.where(peak > 0, peak, 1.0)
+    write_labels(classes, fractions, scale, out)
+    return out
+
+
+def write_labels(
+        classes: np.ndarray, fractions: np.ndarray, scale: np.ndarray,
+        out: np.ndarray
+        ) -> None:
+    '''fill the trailing label columns of out (samples, SAMPLE_WIDTH)'''
+    out[:, PROFILE_LENGTH:] = 0.0
+    out[:, SCALE_COLUMN] = scale
+    out[:, CLASS_COLUMNS] = classes
+    out[:, FRACTION_COLUMNS] = fractions
+    out[:, TUBES_COLUMN] = (classes >= 0).sum(axis=1) - 1
+
+
+@lru_cache(maxsize=1)
+def _worker_bank(scales: Tuple[float, ...], num_layer_lines: int
+                 ) -> ProfileBank:
+    '''one profile bank per worker process, shared by all its shards'''
+    return ProfileBank(chirality_classes(), np.array(scales), num_layer_lines)
+
+
+def _write_shard(task: Dict) -> Tuple[str, int]:
+    '''worker: simulate one shard straight into its memory-mapped .npy'''
+    classes, fractions, scale = task['specs']
+    out = np.lib.format.open_memmap(
+            task['path'], mode='w+', dtype=np.float32,
+            shape=(len(scale), SAMPLE_WIDTH)
+            )
+    render_samples(classes, fractions, scale,
+                   _worker_bank(task['scales'], task['num_layer_lines']), out)
+    out.flush()
+    del out
+    return task['path'], len(scale)
+
+
+def generate(
+        out_dir: Path, num_samples: int, scales: np.ndarray,
+        shard_size: int = 10000, max_tubes: int = MAX_TUBES,
+        fraction_steps: int = 12, num_layer_lines: int = 3, seed: int = 0,
+        workers: Optional[int] = None
+        ) -> Dict:
+    '''write all shards and index.json to out_dir, returns the index'''
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    table = chirality_classes()
+    classes, fractions, scale = sample_specs(
+            num_samples, len(table), scales, max_tubes, fraction_steps, seed
+            )
+    tasks: List[Dict] = []
+    for shard, start in enumerate(range(0, num_samples, shard_size)):
+        rows = slice(start, start+shard_size)
+        tasks.append({'path': str(out_dir / f'shard_{shard:05d}.npy'),
+                      'specs': (classes[rows], fractions[rows], scale[rows]),
+                      'scales': tuple(scales),
+                      'num_layer_lines': num_layer_lines})
+
+    with multiprocessing.Pool(workers) as pool:
+        written = dict(pool.imap_unordered(_write_shard, tasks))
+
+    index = {
+        'sample_width': SAMPLE_WIDTH,
+        'profile_length': PROFILE_LENGTH,
+        'classes': table[:, :2].tolist(),
+        'shards': [{'file': Path(t['path']).name,
+                    'samples': written[t['path']]} for t in tasks],
+        'settings': {'samples': num_samples, 'scales': scales.tolist(),
+                     'max_tubes': max_tubes,
+                     'fraction_steps': fraction_steps,
+                     'num_layer_lines': num_layer_lines, 'seed': seed},
+    }
+    with open(out_dir / 'index.json', 'w') as f:
+        json.dump(index, f, indent=1)
+    return index
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('out_dir', type=Path)
+    parser.add_argument('--samples', type=int, default=100000)
+    parser.add_argument('--shard-size', type=int, default=10000)
+    parser.add_argument('--scales', type=float, nargs=3,
+                        default=(5.0, 20.0, 16),
+                        metavar=('START', 'STOP', 'NUM'),
+                        help='grid of plot scales, as np.linspace')
+    parser.add_argument('--max-tubes', type=int, default=MAX_TUBES,
+                        choices=range(1, MAX_TUBES+1))
+    parser.add_argument('--fraction-steps', type=int, default=12)
+    parser.add_argument('--num-layer-lines', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None,
+                        help='processes, defaults to the number of cores')
+    args = parser.parse_args(argv)
+
+    start, stop, num = args.scales
+    index = generate(args.out_dir, args.samples,
+                     np.linspace(start, stop, int(num)), args.shard_size,
+                     args.max_tubes, args.fraction_steps,
+                     args.num_layer_lines, args.seed, args.workers)
+    print(f"wrote {args.samples} samples in {len(index['shards'])} shards "
+          f"({len(index['classes'])} classes) to {args.out_dir}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+'''4501-point network input from a 2D diffraction image
+
+Detector frames are read through memory maps (.npy, raw frames of a given
+shape and dtype, uncompressed TIFF with tifffile) in blocks of rows, so a
+4k x 4k frame is never loaded whole. The geometry is found on a block
+mean reduced copy:
+
+- the pattern center is the peak of the image convolved with itself
+  (a diffraction pattern is point-symmetric), computed with FFTs,
+- the tube axis is the direction of most power in the image's 2D
+  spectrum (layer lines repeat along the axis), refined by the sharpest
+  projection.
+
+The full resolution frame is then projected onto the tube axis, binned
+into the MESH_ROWS rows of a simulated pattern, background subtracted and
+resampled to PROFILE_LENGTH points with peak 1, like
+LayerLinePattern.axial_profile of diffract_plot's patterns.
+
+    python image_profile.py frame.raw --shape 4096 4096 --dtype uint16
+'''
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+from pathlib import Path
+import argparse
+import time
+import numpy as np
+import scipy.fft
+import scipy.ndimage
+import scipy.signal
+from pattern import PROFILE_LENGTH
+
+
+# longest side of the reduced image the geometry is found on
+WORKING_SIZE: int = 1024
+# rows of a simulated mesh, projections are binned to these
+MESH_ROWS: int = 1000
+# image rows read from a memory map at once
+READ_ROWS: int = 512
+# directions the spectrum's power is binned into, over 180 degrees
+ANGLE_BINS: int = 720
+# profile rows wider than layer lines, the background is below them
+BACKGROUND_ROWS: int = 60
+
+
+class ImageProfile(NamedTuple):
+    profile: np.ndarray  # (PROFILE_LENGTH,) float32, peak 1
+    center: Tuple[float, float]  # (row, column) in image pixels
+    angle: float  # tube axis from the image's vertical, radians
+    extent: float  # pixels from the center to either end of the profile
+    layer_lines: np.ndarray  # profile indices of the layer line peaks
+
+
+def open_image(
+        path: Path, shape: Optional[Sequence[int]] = None,
+        dtype: str = 'uint16', offset: int = 0
+        ) -> np.ndarray:
+    '''memory map of a .npy, TIFF or raw frame (given shape and dtype);
+    other formats are read with Pillow'''
+    path = Path(path)
+    if shape is not None:
+        return np.memmap(path, dtype=dtype, mode='r', offset=offset,
+                         shape=tuple(shape))
+    if path.suffix == '.npy':
+        return np.load(path, mmap_mode='r')
+    if path.suffix.lower() in ('.tif', '.tiff'):
+        try:
+            import tifffile
+            return tifffile.memmap(path, mode='r')
+        except (ImportError, ValueError):
+            # not installed, or compressed: decoded in memory below
+            pass
+    from PIL import Image
+    with Image.open(path) as image:
+        return np.asarray(image.convert('F'))
+
+
+def _rows(image: np.ndarray, start: int, stop: int) -> np.ndarray:
+    '''float32 image rows, colour channels averaged'''
+    block = np.asarray(image[start:stop], dtype=np.float32)
+    return block.mean(axis=2) if block.ndim == 3 else block
+
+
+def reduce(image: np.ndarray, factor: int) -> np.ndarray:
+    '''block mean of factor x factor pixels, read in blocks of rows'''
+    rows, cols = image.shape[0]//factor, image.shape[1]//factor
+    out = np.empty((rows, cols), dtype=np.float32)
+    step = max(READ_ROWS//factor, 1)
+    for start in range(0, rows, step):
+        stop = min(start+step, rows)
+        block = _rows(image, start*factor, stop*factor)[:, :cols*factor]
+        out[start:stop] = block.reshape(stop-start, factor, cols,
+                                        factor).mean(axis=(1, 3))
+    return out
+
+
+def _parabolic(values: np.ndarray, peak: int) -> float:
+    '''sub-bin position of a peak from its neighbours (wrapping)'''
+    left, right = values[peak-1], values[(peak+1) % len(values)]
+    curvature = left - 2*values[peak] + right
+    return peak + (0.5*(left - right)/curvature if curvature < 0 else 0.0)
+
+
+def find_center(image: np.ndarray) -> Tuple[float, float]:
+    '''(row, column) center of point symmetry of a (reduced) image
+
+    The image convolved with itself peaks at twice the center; zero
+    padded, so the convolution does not wrap around.
+    '''
+    image = image - image.mean()
+    shape = [scipy.fft.next_fast_len(2*n) for n in image.shape]
+    spectrum = scipy.fft.rfft2(image, s=shape)
+    convolution = scipy.fft.irfft2(spectrum*spectrum, s=shape)
+    row, col = np.unravel_index(np.argmax(convolution), convolution.shape)
+    return (_parabolic(convolution[:, col], row)/2,
+            _parabolic(convolution[row], col)/2)
+
+
+def find_axis(image: np.ndarray) -> float:
+    '''tube axis of a (reduced) image, radians in [0, pi) from its
+    vertical: the direction of most power in the 2D spectrum'''
+    window = np.outer(np.hanning(image.shape[0]), np.hanning(image.shape[1]))
+    power = np.abs(scipy.fft.rfft2((image - image.mean())*window))**2
+    ky = scipy.fft.fftfreq(image.shape[0])[:, None]
+    kx = scipy.fft.rfftfreq(image.shape[1])[None, :]
+    # the slowest frequencies hold the background, not the layer lines
+    keep = np.hypot(ky, kx) > 4/min(image.shape)
+    bins = np.rint(np.arctan2(kx, ky)*ANGLE_BINS/np.pi).astype(int) \
+        % ANGLE_BINS
+    histogram = np.bincount(np.broadcast_to(bins, power.shape)[keep],
+                            power[keep], ANGLE_BINS)
+    peak = _parabolic(histogram, int(np.argmax(histogram)))
+    return (peak*np.pi/ANGLE_BINS) % np.pi
+
+
+def inscribed_radius(shape: Sequence[int], center: Tuple[float, float]
+                     ) -> float:
+    '''radius of the largest circle about center inside the image, the
+    same along any direction of the tube axis'''
+    return float(np.min(np.minimum(center,
+                                   np.subtract(shape[:2], center))))
+
+
+def project(
+        image: np.ndarray, center: Tuple[float, float], angle: float,
+        extent: float, rows: int = MESH_ROWS
+        ) -> np.ndarray:
+    '''mean intensity across the tube axis in rows bins over
+    -extent...extent along it, read in blocks of image rows'''
+    sums, counts = np.zeros(rows), np.zeros(rows)
+    cols = (np.arange(image.shape[1]) - center[1])*np.sin(angle)
+    for start in range(0, image.shape[0], READ_ROWS):
+        block = _rows(image, start, start+READ_ROWS)
+        along = ((np.arange(start, start+len(block)) - center[0])
+                 * np.cos(angle))[:, None] + cols
+        bins = np.floor((along/extent + 1)*rows/2).astype(np.intp)
+        inside = (bins >= 0) & (bins < rows)
+        sums += np.bincount(bins[inside], block[inside], rows)
+        counts += np.bincount(bins[inside], minlength=rows)
+    return sums/np.maximum(counts, 1)
+
+
+def refine_axis(
+        image: np.ndarray, center: Tuple[float, float], angle: float,
+        step: float, steps: int = 4
+        ) -> float:
+    '''angle within +-steps*step of angle with the sharpest projection'''
+    extent = inscribed_radius(image.shape, center)
+    candidates = angle + step*np.arange(-steps, steps+1)
+    sharpness = [np.sum(np.diff(project(image, center, a, extent,
+                                        min(image.shape)))**2)
+                 for a in candidates]
+    return float(candidates[int(np.argmax(sharpness))] % np.pi)
+
+
+def layer_line_peaks(
+        profile: np.ndarray, sigma: float = 4.0, prominence: float = 0.05
+        ) -> np.ndarray:
+    '''indices of the layer line peaks of a profile, found after a
+    Gaussian (sigma points) smoothing in the Fourier domain'''
+    length = len(profile)
+    padded = scipy.fft.next_fast_len(2*length, real=True)
+    spectrum = scipy.fft.rfft(profile, n=padded)
+    spectrum *= np.exp(-2*(np.pi*sigma*np.fft.rfftfreq(padded))**2)
+    smooth = scipy.fft.irfft(spectrum, n=padded)[:length]
+    peaks, _ = scipy.signal.find_peaks(smooth,
+                                       prominence=prominence*smooth.max())
+    return peaks
+
+
+def extract_profile(
+        image: np.ndarray, extent: Optional[float] = None,
+        background_rows: int = BACKGROUND_ROWS,
+        working_size: int = WORKING_SIZE
+        ) -> ImageProfile:
+    '''ImageProfile of a 2D diffraction image (or its memory map)
+
+    extent, in image pixels from the center, defaults to the radius of
+    the largest circle about the center inside the frame, so the radial
+    scale of the profile does not depend on how the tube lies.
+    '''
+    factor = max(-(-max(image.shape[:2]) // working_size), 1)
+    reduced = reduce(image, factor)
+    center = find_center(reduced)
+    angle = refine_axis(reduced, center, find_axis(reduced),
+                        np.pi/ANGLE_BINS)
+    # block means are centered half a block in
+    center = (factor*center[0] + (factor-1)/2,
+              factor*center[1] + (factor-1)/2)
+    if extent is None:
+        extent = inscribed_radius(image.shape, center)
+
+    rows = project(image, center, angle, extent)
+    if background_rows:
+        rows = scipy.ndimage.white_tophat(rows, size=background_rows)
+    profile = np.interp(np.linspace(0, len(rows)-1, PROFILE_LENGTH),
+                        np.arange(len(rows)), rows)
+    peak = profile.max()
+    profile = (profile/peak if peak > 0 else profile).astype(np.float32)
+    return ImageProfile(profile, center, angle, extent,
+                        layer_line_peaks(profile))
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('image', type=Path)
+    parser.add_argument('--shape', type=int, nargs=2, default=None,
+                        metavar=('ROWS', 'COLUMNS'),
+                        help='of a raw frame, read with --dtype')
+    parser.add_argument('--dtype', default='uint16')
+    parser.add_argument('--offset', type=int, default=0,
+                        help='header bytes of a raw frame')
+    parser.add_argument('--extent', type=float, default=None)
+    parser.add_argument('--out', type=Path, default=None,
+                        help='.npy to save the profile to')
+    args = parser.parse_args(argv)
+
+    image = open_image(args.image, args.shape, args.dtype, args.offset)
+    start = time.perf_counter()
+    result = extract_profile(image, args.extent)
+    elapsed = time.perf_counter() - start
+    print(f'{image.shape[1]}x{image.shape[0]} frame in {1000*elapsed:.0f} '
+          f'ms: center {result.center[0]:.1f}, {result.center[1]:.1f}, '
+          f'axis {np.degrees(result.angle):.2f} degrees, '
+          f'{len(result.layer_lines)} layer line peaks')
+    if args.out is not None:
+        np.save(args.out, result.profile)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+'''CNN chirality prediction with a warm model and micro-batching
+
+The model directory holds the SavedModel exported at the end of
+Notebooks/deep_learning.ipynb and an index.json with its 'classes'
+((n, m) per class id, as written by generate_dataset.py) and
+'fraction_levels'. A directory exported by quantize.py holds a
+TensorFlow Lite model.tflite instead, which needs only the tflite_runtime
+interpreter on CPU serving nodes. Concurrent requests (e.g. from several
+app sessions) are queued and run through the model together in
+micro-batches.
+'''
+from typing import BinaryIO, Callable, List, NamedTuple, Optional, Tuple
+from concurrent.futures import Future
+from pathlib import Path
+import io
+import json
+import os
+import queue
+import threading
+import time
+import numpy as np
+from image_profile import extract_profile
+from pattern import PROFILE_LENGTH
+
+
+MODEL_DIR: Path = Path(os.environ.get(
+        'CNT_MODEL_DIR', Path(__file__).with_name('model')
+        ))
+# TensorFlow Lite model of an exported directory, see quantize.py
+TFLITE_MODEL: str = 'model.tflite'
+# uploads read as diffraction images, see image_profile.py
+IMAGE_SUFFIXES: Tuple[str, ...] = ('.tif', '.tiff', '.png', '.jpg', '.jpeg')
+# requests grouped into one model call, and how long the first one waits
+MAX_BATCH: int = 64
+MAX_DELAY: float = 0.005  # s
+
+
+class Prediction(NamedTuple):
+    n: int
+    m: int
+    fraction_level: int
+    confidence: float
+
+
+def normalise_profile(profile: np.ndarray) -> np.ndarray:
+    '''float32 network input, peak 1, resampled to PROFILE_LENGTH'''
+    profile = np.asarray(profile, dtype=float).ravel()
+    if len(profile) == PROFILE_LENGTH + 10:
+        # a full sample row, drop the label columns
+        profile = profile[:PROFILE_LENGTH]
+    elif len(profile) != PROFILE_LENGTH:
+        profile = np.interp(np.linspace(0, len(profile)-1, PROFILE_LENGTH),
+                            np.arange(len(profile)), profile)
+    peak = profile.max()
+    return (profile/peak if peak > 0 else profile).astype(np.float32)
+
+
+def read_profile(uploaded: BinaryIO) -> np.ndarray:
+    '''1D profile from an uploaded .npy or comma/space separated text file,
+    or extracted from a diffraction image (2D .npy, TIFF, PNG, JPEG)'''
+    name = getattr(uploaded, 'name', '').lower()
+    data = uploaded.read()
+    if name.endswith('.npy'):
+        array = np.load(io.BytesIO(data))
+        if array.ndim >= 2 and min(array.shape[:2]) > 1:
+            return extract_profile(array).profile
+        return array.ravel()
+    if name.endswith(IMAGE_SUFFIXES):
+        from PIL import Image
+        with Image.open(io.BytesIO(data)) as image:
+            return extract_profile(np.asarray(image.convert('F'))).profile
+    text = data.decode() if isinstance(data, bytes) else data
+    return np.loadtxt(io.StringIO(text.replace(',', ' '))).ravel()
+
+
+def load_tflite_model(path: Path, num_threads: Optional[int] = None
+                      ) -> Callable[[np.ndarray], np.ndarray]:
+    '''(batch, PROFILE_LENGTH) -> logits function of a .tflite model'''
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        # the full tensorflow package ships the same interpreter
+        import tensorflow as tf
+        Interpreter = tf.lite.Interpreter
+
+    interpreter = Interpreter(model_path=str(path), num_threads=num_threads)
+    interpreter.allocate_tensors()
+    input_index = interpreter.get_input_details()[0]['index']
+    output_index = interpreter.get_output_details()[0]['index']
+
+    def model(batch: np.ndarray) -> np.ndarray:
+        batch = np.asarray(batch, dtype=np.float32)[..., None]
+        if tuple(interpreter.get_input_details()[0]['shape']) != batch.shape:
+            interpreter.resize_tensor_input(input_index, batch.shape)
+            interpreter.allocate_tensors()
+        interpreter.set_tensor(input_index, batch)
+        interpreter.invoke()
+        return interpreter.get_tensor(output_index)
+
+    model.interpreter = interpreter
+    return model
+
+
+def load_model(model_dir: Path = MODEL_DIR,
+               num_threads: Optional[int] = None
+               ) -> Callable[[np.ndarray], np.ndarray]:
+    '''(batch, PROFILE_LENGTH) -> logits function of the SavedModel, or
+    of model.tflite (run on num_threads) when the directory holds one'''
+    if (Path(model_dir) / TFLITE_MODEL).exists():
+        return load_tflite_model(Path(model_dir) / TFLITE_MODEL, num_threads)
+    # imported here, tensorflow is only needed once a model is used
+    import tensorflow as tf
+
+    loaded = tf.saved_model.load(str(model_dir))
+    serve = loaded.signatures['serving_default']
+    input_name = next(iter(serve.structured_input_signature[1]))
+
+    def model(batch: np.ndarray) -> np.ndarray:
+        outputs = serve(**{input_name: tf.constant(batch[..., None])})
+        return next(iter(outputs.values())).numpy()
+
+    # keep the loaded object alive with its signature
+    model.loaded = loaded
+    return model
+
+
+def top_k(
+        logits: np.ndarray, classes: np.ndarray, fraction_levels: int,
+        k: int = 3
+        ) -> List[List[Prediction]]:
+    '''k most confident chiralities of every row of logits
+
+    Logits are laid out as class + n_classes*fraction bucket (as in the
+    notebook); a chirality's confidence is the sigmoid of its best bucket.
+    '''
+    confidence = 1/(1 + np.exp(-logits.reshape(len(logits), fraction_levels,
+                                               len(classes))))
+    level = confidence.argmax(axis=1)
+    confidence = confidence.max(axis=1)
+    k = min(k, len(classes))
+    best = np.argpartition(-confidence, k-1, axis=1)[:, :k]
+    rows = np.arange(len(logits))[:, None]
+    best = best[rows, np.argsort(-confidence[rows, best], axis=1)]
+    return [[Prediction(int(classes[c, 0]), int(classes[c, 1]),
+                        int(level[r, c]), float(confidence[r, c]))
+             for c in row] for r, row in enumerate(best)]
+
+
+class MicroBatcher:
+    '''runs queued requests through model in batches on one thread'''
+
+    def __init__(
+            self, model: Callable[[np.ndarray], np.ndarray],
+            max_batch: int = MAX_BATCH, max_delay: float = MAX_DELAY
+            ):
+        self._model = model
+        self._max_batch = max_batch
+        self._max_delay = max_delay
+        self._requests: queue.Queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, profile: np.ndarray) -> Future:
+        '''future of the model output for one network input'''
+        future: Future = Future()
+        self._requests.put((profile, future))
+        return future
+
+    def _next_batch(self) -> list:
+        batch = [self._requests.get()]
+        deadline = time.monotonic() + self._max_delay
+        while len(batch) < self._max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._requests.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            try:
+                outputs = self._model(np.stack([p for p, _ in batch]))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), output in zip(batch, outputs):
+                future.set_result(output)
+
+
+class Predictor:
+    '''warm model + label index, shared by every session of a process'''
+
+    def __init__(self, model_dir: Path = MODEL_DIR,
+                 max_batch: int = MAX_BATCH, max_delay: float = MAX_DELAY):
+        model_dir = Path(model_dir)
+        with open(model_dir / 'index.json') as f:
+            index = json.load(f)
+        self.classes = np.array(index['classes'], dtype=int)
+        self.fraction_levels = int(index.get('fraction_levels', 3))
+        self._batcher = MicroBatcher(load_model(model_dir), max_batch,
+                                     max_delay)
+
+    def predict(self, profile: np.ndarray, k: int = 3,
+                timeout: Optional[float] = None) -> List[Prediction]:
+        logits = self._batcher.submit(normalise_profile(profile)) \
+            .result(timeout)
+        return top_k(logits[None], self.classes, self.fraction_levels, k)[0]
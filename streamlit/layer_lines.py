@@ -0,0 +1,51 @@
+'''Layer lines of the helix diffraction theory up to any order
+
+Every reflection (h, k) of the graphene reciprocal lattice, G = h b1 + k b2
+(b1, b2 of length a* at 120 degrees), lands on a layer line with Bessel
+order h*n + k*m for a tube (n, m), at a distance
+a*(k cos(angle) - h cos(60 deg - angle)) from l0 along the tube axis.
+(h, k) and (-h, -k) give the same line mirrored, |J_-v|^2 == |J_v|^2, so
+one of each pair is kept. Lines are numbered by |G|, with the pair member
+and the ties within a shell chosen to reproduce l0...l4 of
+diffract_pattern: (0, 0), (0, 1), (-1, 0), (1, 1), (-1, 1).
+'''
+from functools import lru_cache
+import numpy as np
+
+
+@lru_cache(maxsize=None)
+def reflections(num_layer_lines: int) -> np.ndarray:
+    '''(h, k) of layer lines l0...l_num_layer_lines, (lines, 2) read-only'''
+    # the box holds every reflection with h*h - h*k + k*k <= 3/4*radius**2,
+    # well over num_layer_lines+1 of them
+    radius = int(np.ceil(np.sqrt(num_layer_lines))) + 1
+    h, k = (a.ravel() for a in np.mgrid[-radius:radius+1,
+                                          -radius:radius+1])
+    # one of each (h, k), (-h, -k) pair: k > 0, or k == 0 and h <= 0
+    keep = (k > 0) | ((k == 0) & (h <= 0))
+    h, k = h[keep], k[keep]
+    order = np.lexsort((k, np.abs(h), h*h - h*k + k*k))
+    hk = np.stack([h[order], k[order]], axis=1)[:num_layer_lines+1]
+    hk.flags.writeable = False
+    return hk
+
+
+def layer_line_orders(
+        hk: np.ndarray, chiral_n: np.ndarray, chiral_m: np.ndarray
+        ) -> np.ndarray:
+    '''non-negative Bessel order |h*n + k*m| of every reflection
+
+    (lines, 2) reflections broadcast against chiral_n, chiral_m of shape
+    (..., 1), e.g. n[:, None], to (..., lines).
+    '''
+    return np.abs(hk[:, 0]*np.asarray(chiral_n)
+                  + hk[:, 1]*np.asarray(chiral_m))
+
+
+def layer_line_spacings(
+        hk: np.ndarray, angle: np.ndarray, astar: float
+        ) -> np.ndarray:
+    '''signed distance of every layer line from l0, broadcast as
+    layer_line_orders; spacingD1...spacingD4 for l1...l4'''
+    angle = np.asarray(angle)
+    return astar*(hk[:, 1]*np.cos(angle) - hk[:, 0]*np.cos(np.pi/3 - angle))
@@ -0,0 +1,89 @@
+'''Analytic (n, m) lookup from measured layer line spacings
+
+The spacings D1, D2, D3 of layer lines l1...l3 (spacingD1...spacingD3)
+fix the chiral angle through their ratios, in whatever unit they were
+measured. Tubes with the same angle ((5, 5), (10, 10), ...) can only be
+told apart with the diameter, so a measured diameter is optional but
+recommended. Candidates are held in KD-trees scaled by the measurement
+tolerances, and residuals are in units of those tolerances.
+'''
+from typing import List, NamedTuple, Optional
+from scipy.spatial import cKDTree
+import numpy as np
+from core import BASIS_A0, chiralAngle, chiralIndices, diameter, \
+        spacingD1, spacingD2, spacingD3
+from prefetch import INDEX_RANGE
+
+
+# default largest chiral index of the candidates, the app's largest input
+MAX_INDEX: int = INDEX_RANGE[1]
+
+
+class Match(NamedTuple):
+    n: int
+    m: int
+    residual: float
+
+
+def spacing_ratios(spacings: np.ndarray) -> np.ndarray:
+    '''(D2/D1, D3/D1) of (..., 3) spacings D1, D2, D3'''
+    spacings = np.asarray(spacings, dtype=float)
+    return spacings[..., 1:3] / spacings[..., :1]
+
+
+class SpacingIndex:
+    '''precomputed spacing ratios of every (n, m) up to max_index'''
+
+    def __init__(self, max_index: int = MAX_INDEX,
+                 ratio_tolerance: float = 0.01,
+                 diameter_tolerance: float = 0.05):
+        self.max_index = max_index
+        self.ratio_tolerance = ratio_tolerance
+        self.diameter_tolerance = diameter_tolerance  # nm
+        m, n = np.triu_indices(max_index+1)
+        # every m <= n, without the empty (0, 0) tube
+        self.n, self.m = n[1:], m[1:]
+        indices = chiralIndices(self.n, self.m)
+        angle = chiralAngle(indices)
+        self.diameter = diameter(indices)
+        self.ratios = spacing_ratios(np.stack(
+                [spacingD1(angle, BASIS_A0), spacingD2(angle, BASIS_A0),
+                 spacingD3(angle, BASIS_A0)], axis=-1
+                ))
+        self._ratio_tree = cKDTree(self.ratios/ratio_tolerance)
+        self._tree = cKDTree(np.column_stack([
+                self.ratios/ratio_tolerance,
+                self.diameter/diameter_tolerance
+                ]))
+
+    def query(
+            self, spacings: np.ndarray, diameter: Optional[float] = None,
+            k: int = 5
+            ) -> List[Match]:
+        '''k nearest chiralities to measured (D1, D2, D3)'''
+        return self.query_batch(np.asarray(spacings)[None], k=k,
+                                diameter=None if diameter is None
+                                else np.array([diameter]))[0]
+
+    def query_batch(
+            self, spacings: np.ndarray, k: int = 5,
+            diameter: Optional[np.ndarray] = None
+            ) -> List[List[Match]]:
+        '''k nearest chiralities for each row of (N, 3) spacings'''
+        features = spacing_ratios(spacings)/self.ratio_tolerance
+        if diameter is None:
+            tree = self._ratio_tree
+        else:
+            tree = self._tree
+            features = np.column_stack(
+                    [features, np.asarray(diameter)/self.diameter_tolerance]
+                    )
+        k = min(k, len(self.n))
+        distance, index = tree.query(features, k=k)
+        distance = np.reshape(distance, (len(features), k))
+        index = np.reshape(index, (len(features), k))
+        # RMS over the features, in units of the tolerances
+        residual = distance/np.sqrt(features.shape[1])
+        return [[Match(int(self.n[i]), int(self.m[i]), float(r))
+                 for i, r in zip(row, res)]
+                for row, res in zip(index, residual)]
@@ -0,0 +1,302 @@
+'''Physics-based (n, m) identification of a measured axial profile
+
+Every chirality of indices.csv (each (n, m) once) is simulated at a
+geometric grid of BANK_SCALES. A plot scale only stretches a profile
+about its center (its layer lines sit at distances proportional to
+1/scale), so on a logarithmic radius axis a change of scale is a shift.
+The bank therefore holds every simulated profile folded about its center
+and resampled to LOG_POINTS log-radius points, with intensities
+compressed by INTENSITY_POWER so the weaker layer lines count too.
+
+A measured profile is resampled the same way and cross-correlated with
+every bank entry at once, through FFTs. The best shift within half a
+bank step of each entry fits the scale between the grid points, and the
+best normalised correlation over the scales ranks the chirality.
+Chiralities whose profiles only differ by a stretch tie, and so does
+everything against a flat profile; caveat says when a ranking is one of
+these rather than a confident match.
+
+    python matching.py build bank.npz
+    python matching.py match profile.npy --bank bank.npz
+    python matching.py benchmark --bank bank.npz
+'''
+from typing import List, NamedTuple, Optional
+from pathlib import Path
+import argparse
+import sys
+import time
+import numpy as np
+import scipy.fft
+from batch import batch_patterns, load_indices
+from core import chiralAngle, chiralIndices
+
+
+# simulated plot scales of the bank, as np.geomspace
+BANK_SCALES: np.ndarray = np.geomspace(2.0, 50.0, 16)
+# log-radius points of a folded profile
+LOG_POINTS: int = 512
+# largest / smallest radius resampled, in profile points; the l0 band
+# at the center is inside the smallest
+RADIUS_RANGE: float = 64.0
+# profile intensities are raised to this power before matching
+INTENSITY_POWER: float = 0.25
+# measured profiles cross-correlated with the bank at once
+MATCH_CHUNK_SIZE: int = 8
+# least standard deviation over mean of a resampled measured profile
+# that tells the chiralities apart
+MIN_CONTRAST: float = 1e-3
+# candidates scoring within this of the best are tied with it
+TIE_TOLERANCE: float = 1e-4
+
+
+class Candidate(NamedTuple):
+    n: int
+    m: int
+    scale: float  # fitted plot scale of the simulated pattern
+    score: float  # normalised cross-correlation, 1 is a perfect match
+
+
+def log_radial(
+        profiles: np.ndarray, points: int = LOG_POINTS,
+        radius_range: float = RADIUS_RANGE
+        ) -> np.ndarray:
+    '''(..., points) mean of every profile folded about its center, over
+    geometrically spaced bins of radius'''
+    profiles = np.asarray(profiles, dtype=float)
+    center = (profiles.shape[-1] - 1)//2
+    folded = (profiles[..., center:] + profiles[..., center::-1])/2
+    max_radius = folded.shape[-1] - 1
+    edges = np.geomspace(max_radius/radius_range, max_radius, points+1)
+    # mean over a bin from the cumulative sum, point r covers r +- 0.5
+    cumulative = np.cumsum(folded, axis=-1)
+    low = np.floor(edges - 0.5).astype(int)
+    weight = edges - 0.5 - low
+    at_edges = ((1 - weight)*cumulative[..., low]
+                + weight*cumulative[..., np.minimum(low+1, max_radius)])
+    return np.diff(at_edges, axis=-1)/np.diff(edges)
+
+
+def compress(profiles: np.ndarray) -> np.ndarray:
+    '''profiles with peak 1, raised to INTENSITY_POWER'''
+    profiles = np.clip(profiles, 0, None)
+    peak = profiles.max(axis=-1, keepdims=True)
+    return (profiles/np.where(peak > 0, peak, 1.0))**INTENSITY_POWER
+
+
+def standardise(rows: np.ndarray) -> np.ndarray:
+    '''rows with zero mean and unit norm (all-zero rows stay 0)'''
+    rows = rows - rows.mean(axis=-1, keepdims=True)
+    norm = np.linalg.norm(rows, axis=-1, keepdims=True)
+    return rows/np.where(norm > 0, norm, 1.0)
+
+
+class ProfileMatcher:
+    '''ranks every chirality of a bank against measured profiles
+
+    The bank is kept as float16 log-radius profiles (5 MB for the 324
+    chiralities of indices.csv and 16 scales); their spectra, 11 MB as
+    complex64, are computed when the matcher is made.
+    '''
+
+    def __init__(self, n: np.ndarray, m: np.ndarray, scales: np.ndarray,
+                 bank: np.ndarray, radius_range: float = RADIUS_RANGE):
+        self.n, self.m = np.asarray(n), np.asarray(m)
+        self.scales = np.asarray(scales, dtype=float)
+        self.bank = np.asarray(bank, dtype=np.float16)
+        self.radius_range = radius_range
+        points = self.bank.shape[-1]
+        # log radius step, a shift of k points is a factor exp(k*step)
+        self.step = np.log(radius_range)/points
+        # shifts that reach half way to the neighbouring bank scales
+        spacing = np.log(self.scales.max()/self.scales.min()) \
+            / max(len(self.scales) - 1, 1)
+        self.max_shift = int(np.ceil(spacing/2/self.step)) + 1
+        # padded, so shifts within max_shift do not wrap around
+        self.length = scipy.fft.next_fast_len(points + self.max_shift,
+                                              real=True)
+        self._spectra = np.conj(scipy.fft.rfft(
+                standardise(self.bank.astype(np.float32)).reshape(
+                        -1, points),
+                n=self.length, axis=-1
+                )).astype(np.complex64)
+
+    @classmethod
+    def simulate(
+            cls, scales: np.ndarray = BANK_SCALES,
+            num_layer_lines: int = 3, points: int = LOG_POINTS,
+            radius_range: float = RADIUS_RANGE
+            ) -> 'ProfileMatcher':
+        '''bank of every chirality of indices.csv at scales'''
+        chiral_n, chiral_m, factor = load_indices(unique=True)
+        patterns = batch_patterns(chiral_n[:, None], chiral_m[:, None],
+                                  np.asarray(scales)[None, :],
+                                  factor[:, None], num_layer_lines,
+                                  half=True)
+        profiles = compress([p.axial_profile() for p in patterns])
+        bank = log_radial(profiles, points, radius_range).reshape(
+                len(chiral_n), len(scales), points)
+        return cls(chiral_n, chiral_m, scales, bank, radius_range)
+
+    @classmethod
+    def load(cls, path: Path) -> 'ProfileMatcher':
+        with np.load(path) as bank:
+            return cls(bank['n'], bank['m'], bank['scales'], bank['bank'],
+                       float(bank['radius_range']))
+
+    def save(self, path: Path) -> None:
+        np.savez(path, n=self.n, m=self.m, scales=self.scales,
+                 bank=self.bank, radius_range=self.radius_range)
+
+    def scores(self, profiles: np.ndarray) -> np.ndarray:
+        '''(profiles, chiralities, scales, 2*max_shift+1) normalised
+        cross-correlation of (profiles, PROFILE_LENGTH) profiles with the
+        bank, by shift -max_shift...max_shift'''
+        measured = log_radial(compress(profiles), self.bank.shape[-1],
+                              self.radius_range)
+        spectra = scipy.fft.rfft(standardise(measured).astype(np.float32),
+                                 n=self.length, axis=-1)
+        shifts = np.r_[-self.max_shift:self.max_shift+1] % self.length
+        scores = []
+        for start in range(0, len(spectra), MATCH_CHUNK_SIZE):
+            chunk = spectra[start:start+MATCH_CHUNK_SIZE, None]
+            correlation = scipy.fft.irfft(chunk*self._spectra,
+                                          n=self.length, axis=-1,
+                                          workers=-1)
+            scores.append(correlation[..., shifts])
+        return np.concatenate(scores).reshape(
+                len(profiles), len(self.n), len(self.scales), len(shifts))
+
+    def match_batch(self, profiles: np.ndarray, k: int = 5
+                    ) -> List[List[Candidate]]:
+        '''k best chiralities for each row of (N, PROFILE_LENGTH)
+        profiles'''
+        scores = self.scores(profiles)
+        flat = scores.reshape(len(profiles), len(self.n), -1)
+        best = flat.argmax(axis=-1)
+        score = np.take_along_axis(flat, best[..., None], axis=-1)[..., 0]
+        scale_index, shift = np.divmod(best, scores.shape[-1])
+        # a bank profile shifted out by k points is at exp(k*step) times
+        # the scale of the measured one
+        scale = self.scales[scale_index] \
+            * np.exp(-(shift - self.max_shift)*self.step)
+        k = min(k, len(self.n))
+        # exact ties (e.g. all 0 for a flat profile) keep the bank order
+        ranked = np.argsort(-score, axis=1, kind='stable')[:, :k]
+        return [[Candidate(int(self.n[c]), int(self.m[c]),
+                           float(scale[row, c]), float(score[row, c]))
+                 for c in order]
+                for row, order in enumerate(ranked)]
+
+    def match(self, profile: np.ndarray, k: int = 5) -> List[Candidate]:
+        '''k best chiralities for a (PROFILE_LENGTH,) profile'''
+        return self.match_batch(np.asarray(profile)[None], k)[0]
+
+    def contrast(self, profiles: np.ndarray) -> np.ndarray:
+        '''(N,) standard deviation over mean of each row of
+        (N, PROFILE_LENGTH) profiles as it is matched, 0 if flat'''
+        measured = log_radial(compress(profiles), self.bank.shape[-1],
+                              self.radius_range)
+        mean = measured.mean(axis=-1)
+        return measured.std(axis=-1)/np.where(mean > 0, mean, 1.0)
+
+    def caveat(self, profile: np.ndarray, candidates: List[Candidate]
+               ) -> Optional[str]:
+        '''why the ranking of a profile's candidates is not a confident
+        match, or None'''
+        if self.contrast(np.asarray(profile)[None])[0] < MIN_CONTRAST:
+            return ('The profile is nearly flat, so it matches every '
+                    'chirality about equally well and the ranking is '
+                    'arbitrary.')
+        tied = sum(c.score >= candidates[0].score - TIE_TOLERANCE
+                   for c in candidates)
+        if tied > 1:
+            return (f'The best {tied} candidates score within '
+                    f'{TIE_TOLERANCE:g} of each other, so the profile '
+                    f'cannot tell them apart and their order is arbitrary.')
+        return None
+
+
+def benchmark(matcher: ProfileMatcher, samples: int = 200, seed: int = 0
+              ) -> dict:
+    '''top-1/top-5 accuracy, top-1 chiral angle accuracy (tubes of one
+    angle differ only slightly) and ms per profile on simulated profiles
+    of random chiralities at random scales between the bank's'''
+    rng = np.random.default_rng(seed)
+    chiral_n, chiral_m, factor = load_indices(unique=True)
+    tubes = rng.integers(0, len(chiral_n), samples)
+    scales = np.exp(rng.uniform(np.log(matcher.scales[1]),
+                                np.log(matcher.scales[-2]), samples))
+    profiles = np.array([
+            p.axial_profile() for p in batch_patterns(
+                    chiral_n[tubes], chiral_m[tubes], scales, factor[tubes],
+                    half=True)
+            ])
+    start = time.perf_counter()
+    matches = matcher.match_batch(profiles, k=5)
+    elapsed = time.perf_counter() - start
+    truth = list(zip(chiral_n[tubes].tolist(), chiral_m[tubes].tolist()))
+    ranks = [[(c.n, c.m) for c in candidates] for candidates in matches]
+    best = np.array([r[0] for r in ranks])
+    return {
+        'top1': float(np.mean([r[0] == t for r, t in zip(ranks, truth)])),
+        'top5': float(np.mean([t in r for r, t in zip(ranks, truth)])),
+        'top1_angle': float(np.mean(np.isclose(
+                chiralAngle(chiralIndices(best[:, 0], best[:, 1])),
+                chiralAngle(chiralIndices(chiral_n[tubes],
+                                          chiral_m[tubes]))))),
+        'ms_per_profile': 1000*elapsed/samples,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    to_build = commands.add_parser('build')
+    to_build.add_argument('out', type=Path)
+    to_build.add_argument('--scales', type=float, nargs=3,
+                          default=(2.0, 50.0, 16),
+                          metavar=('START', 'STOP', 'NUM'),
+                          help='bank scales, as np.geomspace')
+    to_build.add_argument('--num-layer-lines', type=int, default=3)
+    to_match = commands.add_parser('match')
+    to_match.add_argument('profile', type=Path)
+    to_match.add_argument('--bank', type=Path, default=None)
+    to_match.add_argument('-k', type=int, default=5)
+    to_benchmark = commands.add_parser('benchmark')
+    to_benchmark.add_argument('--bank', type=Path, default=None)
+    to_benchmark.add_argument('--samples', type=int, default=200)
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        start, stop, num = args.scales
+        begin = time.perf_counter()
+        matcher = ProfileMatcher.simulate(np.geomspace(start, stop, int(num)),
+                                          args.num_layer_lines)
+        matcher.save(args.out)
+        print(f'{matcher.bank.shape[0]} chiralities x '
+              f'{matcher.bank.shape[1]} scales in '
+              f'{time.perf_counter() - begin:.1f} s to {args.out}')
+        return
+    matcher = (ProfileMatcher.simulate() if args.bank is None
+               else ProfileMatcher.load(args.bank))
+    if args.command == 'match':
+        # imported here, it pulls in the image readers
+        from inference import normalise_profile, read_profile
+        with open(args.profile, 'rb') as f:
+            profile = normalise_profile(read_profile(f))
+        candidates = matcher.match(profile, args.k)
+        for c in candidates:
+            print(f'({c.n:2d}, {c.m:2d})  scale {c.scale:6.2f}  '
+                  f'score {c.score:.4f}')
+        caveat = matcher.caveat(profile, candidates)
+        if caveat is not None:
+            print(caveat, file=sys.stderr)
+    else:
+        result = benchmark(matcher, args.samples)
+        print(f"top-1 {result['top1']:.3f}, top-5 {result['top5']:.3f}, "
+              f"top-1 angle {result['top1_angle']:.3f}, "
+              f"{result['ms_per_profile']:.2f} ms/profile")
+
+
+if __name__ == '__main__':
+    main()
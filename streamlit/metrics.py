@@ -0,0 +1,172 @@
+'''Per-stage timers and counters of the simulation and app hot paths
+
+    with metrics.timer('core/bessel'):
+        ...
+    metrics.count('cache/diffract_pattern/hit')
+
+record into one process-wide registry, shared by every session and the
+prefetch threads, once enabled with $CNT_METRICS=1 or enable(). Until
+then timer() returns a shared no-op context and count() returns at once,
+so instrumented code pays one flag check per call.
+
+snapshot() summarises every stage (calls, total, mean, p50, p95, max and
+last ms over the most recent RECENT calls) and counter; dump() writes it
+as JSON, e.g. after every rerun to $CNT_METRICS_FILE for a scraper.
+
+    python metrics.py
+
+times a few app-like states with metrics on and prints the snapshot.
+'''
+from typing import Any, Deque, Dict, Optional
+from collections import deque
+from contextlib import nullcontext
+from pathlib import Path
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+# durations per stage the percentiles are taken over
+RECENT: int = 1000
+
+_enabled: bool = os.environ.get('CNT_METRICS', '') not in ('', '0')
+_lock = threading.Lock()
+_durations: Dict[str, Deque[float]] = {}
+_totals: Dict[str, list] = {}  # name: [calls, seconds, max seconds]
+_counters: Dict[str, int] = {}
+_null = nullcontext()
+
+
+def enable(on: bool = True) -> None:
+    global _enabled
+    _enabled = on
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def record(name: str, seconds: float) -> None:
+    '''add one duration of stage name'''
+    if not _enabled:
+        return
+    with _lock:
+        if name not in _totals:
+            _totals[name] = [0, 0.0, 0.0]
+            _durations[name] = deque(maxlen=RECENT)
+        totals = _totals[name]
+        totals[0] += 1
+        totals[1] += seconds
+        totals[2] = max(totals[2], seconds)
+        _durations[name].append(seconds)
+
+
+class _Timer:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self) -> '_Timer':
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        record(self.name, time.perf_counter() - self.start)
+
+
+def timer(name: str) -> Any:
+    '''context manager timing its block as stage name'''
+    return _Timer(name) if _enabled else _null
+
+
+def count(name: str, increment: int = 1) -> None:
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + increment
+
+
+def reset() -> None:
+    with _lock:
+        _durations.clear()
+        _totals.clear()
+        _counters.clear()
+
+
+def _percentile(ordered: list, q: float) -> float:
+    return ordered[min(int(q*len(ordered)), len(ordered) - 1)]
+
+
+def snapshot() -> Dict[str, Any]:
+    '''summary of every stage (times in ms) and counter so far'''
+    with _lock:
+        totals = {name: list(t) for name, t in _totals.items()}
+        durations = {name: list(d) for name, d in _durations.items()}
+        counters = dict(_counters)
+    stages = {}
+    for name in sorted(totals):
+        calls, seconds, longest = totals[name]
+        recent = sorted(durations[name])
+        stages[name] = {
+            'calls': calls,
+            'total_ms': 1000*seconds,
+            'mean_ms': 1000*seconds/calls,
+            'p50_ms': 1000*_percentile(recent, 0.5),
+            'p95_ms': 1000*_percentile(recent, 0.95),
+            'max_ms': 1000*longest,
+            'last_ms': 1000*durations[name][-1],
+        }
+    return {'time': time.time(), 'pid': os.getpid(), 'stages': stages,
+            'counters': dict(sorted(counters.items()))}
+
+
+def dump(path: Path) -> None:
+    '''write snapshot() as JSON to path, replaced atomically so a scraper
+    never reads a partial file'''
+    path = Path(path)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix='.' + path.name)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(snapshot(), f, indent=1)
+    os.replace(tmp, path)
+
+
+def main(argv: Optional[list] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--out', type=Path, default=None,
+                        help='JSON file to dump the snapshot to')
+    args = parser.parse_args(argv)
+
+    # imported here, so the simulation core can import this module; and
+    # run as a script, this is __main__, not the metrics the core records
+    # into
+    from core import diffract_plot, factor_lookup
+    from render import render
+    import metrics
+
+    metrics.enable()
+    for n, m, scale, option in [(20, 3, 10.0, 'Linear'),
+                                (20, 3, 10.0, 'Contrast'),
+                                (20, 3, 10.1, 'Linear'),
+                                (20, 3, 10.0, 'Linear'),
+                                (13, 7, 25.0, 'Contrast')]:
+        with metrics.timer('rerun'):
+            _, _, mesh = diffract_plot(n, m, 3, scale, option, 'Yes',
+                                       int(factor_lookup(n, m)))
+            render(mesh)
+    result = metrics.snapshot()
+    for name, stage in result['stages'].items():
+        print(f"{name:>28} {stage['calls']:4d} calls  "
+              f"{stage['mean_ms']:8.3f} ms mean  "
+              f"{stage['max_ms']:8.3f} ms max")
+    for name, value in result['counters'].items():
+        print(f'{name:>28} {value:4d}')
+    if args.out is not None:
+        metrics.dump(args.out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+'''Patterns of several tubes as weighted sums of cached single tubes
+
+At a given scale every tube is drawn on the same reciprocal space grid,
+so a mixture (bundle) of tubes is the fraction weighted sum of their
+Linear intensities, with the Contrast transform applied to the sum. The
+single tube patterns come from caches (cached half patterns for the
+app, a ProfileBank of axial profiles for datasets), so a new mixture of
+known tubes costs a few vector adds and no Bessel evaluations.
+'''
+from typing import Optional, Sequence, Tuple
+import numpy as np
+from batch import batch_patterns
+from core import diffract_pattern, factor_lookup, intensity_transform
+from pattern import PROFILE_LENGTH, mirror_quadrant
+
+
+class ProfileBank:
+    '''clean axial profiles of every (class, scale), simulated on first use
+
+    Holds len(table)*len(scales) float32 profiles at most, 93 MB for the
+    324 chiralities of indices.csv and 16 scales.
+    '''
+
+    def __init__(self, table: np.ndarray, scales: np.ndarray,
+                 num_layer_lines: int = 3):
+        self.table = table
+        self.scales = np.asarray(scales, dtype=float)
+        self.num_layer_lines = num_layer_lines
+        self.profiles = np.zeros((len(table), len(scales), PROFILE_LENGTH),
+                                 dtype=np.float32)
+        self.ready = np.zeros((len(table), len(scales)), dtype=bool)
+
+    def __call__(self, classes: np.ndarray, scale_index: np.ndarray
+                 ) -> np.ndarray:
+        '''(..., PROFILE_LENGTH) profiles of broadcast classes, scales'''
+        classes, scale_index = np.broadcast_arrays(classes, scale_index)
+        missing = ~self.ready[classes, scale_index]
+        if missing.any():
+            keys = np.unique(np.stack([classes[missing],
+                                       scale_index[missing]], axis=1),
+                             axis=0)
+            rows = self.table[keys[:, 0]]
+            patterns = batch_patterns(rows[:, 0], rows[:, 1],
+                                      self.scales[keys[:, 1]], rows[:, 2],
+                                      self.num_layer_lines, half=True)
+            self.profiles[keys[:, 0], keys[:, 1]] = [
+                    p.axial_profile() for p in patterns]
+            self.ready[keys[:, 0], keys[:, 1]] = True
+        return self.profiles[classes, scale_index]
+
+    def scale_index(self, scale: np.ndarray) -> np.ndarray:
+        '''bank index of scales taken from the (ascending) bank scales'''
+        return np.searchsorted(self.scales, scale)
+
+    def mix(self, classes: np.ndarray, fractions: np.ndarray,
+            scale_index: np.ndarray) -> np.ndarray:
+        '''(samples, PROFILE_LENGTH) fraction weighted sum of the profiles
+        of (samples, tubes) classes, -1 for an empty slot'''
+        present = classes >= 0
+        tubes = self(np.where(present, classes, 0), scale_index[:, None])
+        weights = np.where(present, fractions, 0.0).astype(np.float32)
+        return np.matmul(weights[:, None, :], tubes)[:, 0]
+
+
+def mixture_pattern(
+        tubes: Sequence[Tuple[int, int]], fractions: Sequence[float],
+        num_layer_lines: int, scale: float, option: str, lines: str,
+        out: Optional[np.ndarray] = None
+        ) -> np.ndarray:
+    '''(1000, 1000) mesh of the (n, m) tubes superposed with fractions
+
+    Fractions are normalised to sum to 1. Each tube is the cached Linear
+    half pattern of diffract_pattern, so only new tubes are simulated.
+    '''
+    fractions = np.asarray(fractions, dtype=float)
+    fractions = fractions/fractions.sum()
+    total, quadrant = None, None
+    for (chiral_n, chiral_m), fraction in zip(tubes, fractions):
+        pattern = diffract_pattern(
+                chiral_n, chiral_m, num_layer_lines, scale, 'Linear', lines,
+                int(factor_lookup(chiral_n, chiral_m)), half=True
+                )
+        quadrant = pattern.quadrant(quadrant)
+        if total is None:
+            total = np.zeros_like(quadrant)
+        total += fraction*quadrant
+    total = intensity_transform(total, option)
+    if out is None:
+        out = np.empty((2*len(total), 2*len(total)))
+    return mirror_quadrant(total, out)
@@ -0,0 +1,121 @@
+'''Compact layer line representation of a diffraction pattern'''
+from typing import List, NamedTuple, Optional, Tuple
+import numpy as np
+
+
+# length of the 1D network input, X_length - 10 in deep_learning.ipynb
+PROFILE_LENGTH: int = 4501
+# mesh rows of a layer line band at the app's resolution
+BAND_WIDTH: int = 6
+
+
+class LayerLinePattern(NamedTuple):
+    '''diffraction pattern stored as its layer lines only
+
+    Every layer line is a band of band_width mesh rows around a positive
+    and a mirrored negative row, both holding the same 1D profile. Bands
+    are written in order, so a later line overwrites an earlier one where
+    they overlap (as the dense mesh of diffract_plot does).
+
+    The pattern is mirror-symmetric in both axes, so a half pattern only
+    holds the non-negative half of the radial axis and its profiles;
+    dense() assembles one quadrant and mirrors it.
+    '''
+    radius_spacing: np.ndarray  # radial axis, shape (resolution,)
+    pos_rows: np.ndarray  # positive mesh row per layer line, shape (lines,)
+    neg_rows: np.ndarray  # negative mesh row per layer line, shape (lines,)
+    profiles: np.ndarray  # intensity per layer line, (lines, resolution)
+    band_width: int = BAND_WIDTH
+    half: bool = False  # radius_spacing and profiles are the x >= 0 half
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        size = len(self.radius_spacing)*(2 if self.half else 1)
+        return (size, size)
+
+    @property
+    def nbytes(self) -> int:
+        return (self.radius_spacing.nbytes + self.pos_rows.nbytes
+                + self.neg_rows.nbytes + self.profiles.nbytes)
+
+    def dense(self, out: Optional[np.ndarray] = None) -> np.ndarray:
+        '''2D mesh of the pattern, only built when rendering needs it'''
+        if out is None:
+            out = np.empty(self.shape, dtype=self.profiles.dtype)
+        elif out.shape != self.shape:
+            raise ValueError(
+                    f'out must have shape {self.shape}, got {out.shape}'
+                    )
+        if self.half:
+            size = len(self.radius_spacing)
+            return mirror_quadrant(self.quadrant(out[size:, size:]), out)
+        out[...] = 0.0
+        for rows, profile in zip(self._bands(), self.profiles):
+            for band in rows:
+                out[band, :] = profile
+        return out
+
+    def _bands(self) -> List[Tuple[slice, slice]]:
+        '''(positive, negative) row slices of every line's bands, clipped
+        to the mesh, so a line off the plot does not wrap around'''
+        size, half = self.shape[0], self.band_width//2
+        return [tuple(slice(min(max(row-half, 0), size),
+                            min(max(row+half, 0), size))
+                      for row in (pos, neg))
+                for pos, neg in zip(self.pos_rows, self.neg_rows)]
+
+    def quadrant(self, out: Optional[np.ndarray] = None) -> np.ndarray:
+        '''x >= 0, positive row quarter of dense() from a half pattern
+
+        The negative band of a line is the mirror image of its positive
+        one, so within the quadrant every line is a single band at its
+        distance from the center row, clipped to the quadrant.
+        '''
+        if not self.half:
+            raise ValueError('quadrant needs a half pattern')
+        size = len(self.radius_spacing)
+        if out is None:
+            out = np.empty((size, size), dtype=self.profiles.dtype)
+        out[...] = 0.0
+        half = self.band_width//2
+        for row, profile in zip(np.abs(self.pos_rows - size),
+                                self.profiles):
+            out[max(row-half, 0):row+half, :] = profile
+        return out
+
+    def axial_profile(self, length: int = PROFILE_LENGTH) -> np.ndarray:
+        '''intensity along the tube axis, resampled to length points
+
+        Each mesh row holds its layer line profile summed over the radial
+        axis, so this is the projection of dense() onto the tube axis
+        without building it. This is the 1D network input (before
+        normalisation).
+        '''
+        half = self.band_width//2
+        totals = self.profiles.sum(axis=1)*(2 if self.half else 1)
+        if self.half:
+            # bands as quadrant() clips them, mirrored
+            size = len(self.radius_spacing)
+            quarter = np.zeros(size)
+            for row, total in zip(np.abs(self.pos_rows - size), totals):
+                quarter[max(row-half, 0):row+half] = total
+            rows = np.concatenate([quarter[::-1], quarter])
+        else:
+            rows = np.zeros(self.shape[0])
+            for bands, total in zip(self._bands(), totals):
+                for band in bands:
+                    rows[band] = total
+        return np.interp(np.linspace(0, len(rows)-1, length),
+                         np.arange(len(rows)), rows)
+
+
+def mirror_quadrant(quadrant: np.ndarray, out: np.ndarray) -> np.ndarray:
+    '''fill out (2*size, 2*size) with the mirror images of its
+    (size, size) x >= 0, positive row quadrant, which may be a view of
+    out[size:, size:]'''
+    size = len(quadrant)
+    if not np.may_share_memory(quadrant, out):
+        out[size:, size:] = quadrant
+    out[size:, :size] = quadrant[:, ::-1]
+    out[:size] = out[size:][::-1]
+    return out
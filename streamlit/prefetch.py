@@ -0,0 +1,127 @@
+'''Speculative simulation of the app's neighbouring slider states
+
+Users nudge the scale slider and the n, m inputs one step at a time, so
+after every render the Prefetcher simulates the states next to it (scale
++-1...SCALE_STEPS steps, then n+-1, m+-1, nearest first) on a few
+background threads into the cache.py backend. The next rerun then finds
+its pattern cached. States that are no longer next to the latest one are
+cancelled before they start, and a rerun asking for a state that is
+being simulated waits for it instead of simulating it again.
+'''
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Tuple
+import threading
+from cache import NoCache, get_backend
+from core import diffract_pattern, factor_lookup
+import metrics
+
+
+# background threads, each simulates one state at a time
+PREFETCH_WORKERS: int = 2
+# slider steps of scale prefetched on either side
+SCALE_STEPS: int = 3
+# the app's scale slider and chiral index inputs
+SCALE_STEP: float = 0.1
+SCALE_RANGE: Tuple[float, float] = (0.1, 50.0)
+INDEX_RANGE: Tuple[int, int] = (0, 40)
+
+
+class SliderState(NamedTuple):
+    chiral_n: int
+    chiral_m: int
+    num_layer_lines: int
+    scale: float
+    option: str
+    lines: str
+
+
+def simulate(state: SliderState) -> None:
+    '''diffract_plot's pattern of state, into the cache'''
+    with metrics.timer('prefetch/simulate'):
+        diffract_pattern(
+                state.chiral_n, state.chiral_m, state.num_layer_lines,
+                state.scale, state.option, state.lines,
+                int(factor_lookup(state.chiral_n, state.chiral_m)),
+                half=True
+                )
+
+
+def neighbours(state: SliderState, scale_steps: int = SCALE_STEPS
+               ) -> List[SliderState]:
+    '''states one input step away from state, nearest first'''
+    states = []
+    for step in range(1, scale_steps+1):
+        for sign in (1, -1):
+            # rounded like the slider's values, so cache keys match
+            scale = round(state.scale + sign*step*SCALE_STEP, 1)
+            if SCALE_RANGE[0] <= scale <= SCALE_RANGE[1]:
+                states.append(state._replace(scale=scale))
+        if step > 1:
+            continue
+        for sign in (1, -1):
+            for field in ('chiral_n', 'chiral_m'):
+                index = getattr(state, field) + sign
+                neighbour = state._replace(**{field: index})
+                # (0, 0) is not a tube
+                if (INDEX_RANGE[0] <= index <= INDEX_RANGE[1]
+                        and neighbour.chiral_n + neighbour.chiral_m > 0):
+                    states.append(neighbour)
+    return states
+
+
+class Prefetcher:
+    '''simulates the neighbours of the latest state in the background
+
+    One per process (see helper.load_prefetcher): the latest state of any
+    session decides which pending states are stale.
+    '''
+
+    def __init__(self, workers: int = PREFETCH_WORKERS,
+                 scale_steps: int = SCALE_STEPS):
+        self.scale_steps = scale_steps
+        self._executor = ThreadPoolExecutor(
+                workers, thread_name_prefix='prefetch'
+                )
+        self._pending: Dict[SliderState, Future] = {}
+        # re-entrant: cancelling a future runs its _done callback at once
+        self._lock = threading.RLock()
+
+    def prefetch(self, state: SliderState) -> None:
+        '''cancel stale states, queue the neighbours of state'''
+        if isinstance(get_backend(), NoCache):
+            # nowhere to keep the results
+            return
+        wanted = neighbours(state, self.scale_steps)
+        with self._lock:
+            for pending, future in list(self._pending.items()):
+                if pending not in wanted and future.cancel():
+                    metrics.count('prefetch/cancelled')
+            for neighbour in wanted:
+                if neighbour not in self._pending:
+                    future = self._executor.submit(simulate, neighbour)
+                    self._pending[neighbour] = future
+                    future.add_done_callback(
+                            lambda _, key=neighbour: self._done(key))
+
+    def wait(self, state: SliderState) -> None:
+        '''wait for state if it is being prefetched, so it is simulated
+        once; a queued state is simulated by the caller instead'''
+        with self._lock:
+            future = self._pending.get(state)
+            if future is not None and future.cancel():
+                return
+        if future is not None:
+            metrics.count('prefetch/waited')
+            # a failed prefetch is retried, and reported, by the caller
+            future.exception()
+
+    def _done(self, state: SliderState) -> None:
+        with self._lock:
+            self._pending.pop(state, None)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            for future in list(self._pending.values()):
+                future.cancel()
+            self._pending.clear()
+        self._executor.shutdown(wait=True)
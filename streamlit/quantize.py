@@ -0,0 +1,245 @@
+'''Quantized TensorFlow Lite exports of the chirality CNN for CPU serving
+
+The SavedModel of Notebooks/deep_learning.ipynb is converted to a
+model.tflite (with its index.json, so inference.Predictor and the app load
+it like the SavedModel) in one of QUANTIZATIONS: float16 weights, int8
+weights with float activations ('dynamic'), or int8 weights and
+activations calibrated on generated samples ('int8').
+
+    python quantize.py export model/ model_int8/ --quantization int8 \\
+        --samples data/shard_00000.npy
+    python quantize.py report model/ model_fp16/ model_int8/ \\
+        --samples data/shard_00001.npy
+    python quantize.py run model_int8/ profiles.npy logits.npy
+
+report compares every export with the float model (size, latency, top-1
+agreement, logit error and top-1 accuracy on labelled samples), run
+infers a whole .npy of profiles with one interpreter per core.
+'''
+from typing import Callable, Iterator, List, NamedTuple, Optional, \
+        Sequence, Tuple
+from functools import lru_cache
+from pathlib import Path
+import argparse
+import json
+import multiprocessing
+import shutil
+import time
+import numpy as np
+from inference import MAX_BATCH, TFLITE_MODEL, load_model
+from pattern import PROFILE_LENGTH
+
+
+QUANTIZATIONS: Sequence[str] = ('float32', 'float16', 'dynamic', 'int8')
+# samples the int8 activation ranges are calibrated on
+CALIBRATION_SAMPLES: int = 500
+# profiles per task of the batch runner
+RUN_CHUNK_SIZE: int = 512
+
+
+class Report(NamedTuple):
+    name: str
+    megabytes: float  # on disk
+    latency: float  # ms for one profile
+    throughput: float  # profiles/s in MAX_BATCH batches
+    agreement: float  # top-1 chirality equal to the float model's
+    max_logit_error: float  # largest |logit - float logit|
+    accuracy: Optional[float]  # top-1 chirality among the true tubes
+
+
+def read_samples(paths: Sequence[Path], limit: Optional[int] = None
+                 ) -> np.ndarray:
+    '''up to limit rows of .npy profiles or generate_dataset.py shards'''
+    rows = []
+    for path in paths:
+        rows.append(np.load(path, mmap_mode='r')[:limit])
+        if limit is not None:
+            limit -= len(rows[-1])
+            if limit <= 0:
+                break
+    return np.concatenate(rows)
+
+
+def normalise_profiles(rows: np.ndarray) -> np.ndarray:
+    '''float32 (samples, PROFILE_LENGTH) network inputs, each peak 1'''
+    profiles = np.asarray(rows[:, :PROFILE_LENGTH], dtype=np.float32)
+    peak = profiles.max(axis=1, keepdims=True)
+    return profiles/np.where(peak > 0, peak, 1.0)
+
+
+def export(
+        model_dir: Path, out_dir: Path, quantization: str = 'dynamic',
+        calibration: Optional[np.ndarray] = None
+        ) -> Path:
+    '''write model_dir's SavedModel as out_dir/model.tflite and copy its
+    index.json; int8 needs calibration profiles'''
+    # imported here, only exporting needs the converter
+    import tensorflow as tf
+
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(
+                f'quantization must be one of {QUANTIZATIONS}, got '
+                f'{quantization!r}'
+                )
+    converter = tf.lite.TFLiteConverter.from_saved_model(str(model_dir))
+    if quantization != 'float32':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == 'int8':
+        if calibration is None:
+            raise ValueError('int8 quantization needs calibration samples')
+        profiles = normalise_profiles(calibration)
+        converter.representative_dataset = lambda: (
+                [profile[None, :, None]] for profile in profiles)
+        # inputs and outputs stay float32, so callers are unchanged
+        converter.target_spec.supported_ops = [
+                tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    path = out_dir / TFLITE_MODEL
+    path.write_bytes(converter.convert())
+    shutil.copy(Path(model_dir) / 'index.json', out_dir / 'index.json')
+    return path
+
+
+def _megabytes(model_dir: Path) -> float:
+    model_dir = Path(model_dir)
+    files = ([model_dir / TFLITE_MODEL]
+             if (model_dir / TFLITE_MODEL).exists()
+             else [f for f in model_dir.rglob('*') if f.is_file()])
+    return sum(f.stat().st_size for f in files)/2**20
+
+
+def best_classes(logits: np.ndarray, n_classes: int) -> np.ndarray:
+    '''top-1 chirality (class id) of every row, over all fraction buckets'''
+    return logits.reshape(len(logits), -1, n_classes).max(axis=1) \
+        .argmax(axis=1)
+
+
+def _batches(profiles: np.ndarray, size: int) -> Iterator[np.ndarray]:
+    for start in range(0, len(profiles), size):
+        yield profiles[start:start+size]
+
+
+def compare(
+        reference_dir: Path, model_dirs: Sequence[Path], samples: np.ndarray,
+        repeats: int = 3
+        ) -> List[Report]:
+    '''Report of the float model and every export on samples
+
+    Accuracy is only reported for full sample rows (with labels).
+    '''
+    with open(Path(reference_dir) / 'index.json') as f:
+        n_classes = len(json.load(f)['classes'])
+    profiles = normalise_profiles(samples)
+    labelled = samples.shape[1] > PROFILE_LENGTH
+    reference = None
+    reports = []
+    for model_dir in [reference_dir, *model_dirs]:
+        model = load_model(model_dir)
+        model(profiles[:1])
+        latency = np.inf
+        for _ in range(repeats):
+            start = time.perf_counter()
+            model(profiles[:1])
+            latency = min(latency, time.perf_counter() - start)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            logits = np.concatenate([model(batch) for batch
+                                     in _batches(profiles, MAX_BATCH)])
+        throughput = repeats*len(profiles)/(time.perf_counter() - start)
+
+        best = best_classes(logits, n_classes)
+        if reference is None:
+            reference = logits, best
+        accuracy = None
+        if labelled:
+            accuracy = float(np.mean(np.any(
+                    best[:, None] == samples[:, -7:-4].astype(int), axis=1)))
+        reports.append(Report(
+                Path(model_dir).name, _megabytes(model_dir), 1000*latency,
+                throughput, float(np.mean(best == reference[1])),
+                float(np.abs(logits - reference[0]).max()), accuracy))
+    return reports
+
+
+@lru_cache(maxsize=1)
+def _worker_model(model_dir: str) -> Callable[[np.ndarray], np.ndarray]:
+    '''the model of a worker process, one single-threaded interpreter'''
+    return load_model(Path(model_dir), num_threads=1)
+
+
+def _run_chunk(task: Tuple[str, np.ndarray]) -> np.ndarray:
+    model_dir, rows = task
+    model = _worker_model(model_dir)
+    return np.concatenate([model(batch) for batch in
+                           _batches(normalise_profiles(rows), MAX_BATCH)])
+
+
+def run(
+        model_dir: Path, samples: np.ndarray, workers: Optional[int] = None,
+        chunk_size: int = RUN_CHUNK_SIZE
+        ) -> np.ndarray:
+    '''logits of every row of samples, in chunks over worker processes'''
+    # spawned, tensorflow is not fork safe
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(workers) as pool:
+        return np.concatenate(pool.map(
+                _run_chunk, ((str(model_dir), rows) for rows
+                             in _batches(samples, chunk_size))
+                ))
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    to_export = commands.add_parser('export')
+    to_export.add_argument('model_dir', type=Path)
+    to_export.add_argument('out_dir', type=Path)
+    to_export.add_argument('--quantization', choices=QUANTIZATIONS,
+                           default='dynamic')
+    to_export.add_argument('--samples', type=Path, nargs='*', default=[],
+                           help='.npy calibration samples for int8')
+    to_report = commands.add_parser('report')
+    to_report.add_argument('model_dir', type=Path)
+    to_report.add_argument('exports', type=Path, nargs='+')
+    to_report.add_argument('--samples', type=Path, nargs='+', required=True)
+    to_report.add_argument('--limit', type=int, default=2000)
+    to_run = commands.add_parser('run')
+    to_run.add_argument('model_dir', type=Path)
+    to_run.add_argument('samples', type=Path)
+    to_run.add_argument('out', type=Path)
+    to_run.add_argument('--workers', type=int, default=None,
+                        help='processes, defaults to the number of cores')
+    args = parser.parse_args(argv)
+
+    if args.command == 'export':
+        calibration = (read_samples(args.samples, CALIBRATION_SAMPLES)
+                       if args.samples else None)
+        path = export(args.model_dir, args.out_dir, args.quantization,
+                      calibration)
+        print(f'wrote {path} ({path.stat().st_size/2**20:.1f} MB)')
+    elif args.command == 'report':
+        reports = compare(args.model_dir, args.exports,
+                          read_samples(args.samples, args.limit))
+        print(f"{'model':>16} {'MB':>7} {'ms/1':>7} {'profiles/s':>11} "
+              f"{'agree':>6} {'max err':>8} {'acc':>6}")
+        for r in reports:
+            accuracy = '-' if r.accuracy is None else f'{r.accuracy:.4f}'
+            print(f'{r.name:>16} {r.megabytes:7.2f} {r.latency:7.2f} '
+                  f'{r.throughput:11.0f} {r.agreement:6.4f} '
+                  f'{r.max_logit_error:8.4f} {accuracy:>6}')
+    else:
+        samples = np.load(args.samples, mmap_mode='r')
+        start = time.perf_counter()
+        logits = run(args.model_dir, samples, args.workers)
+        elapsed = time.perf_counter() - start
+        np.save(args.out, logits)
+        print(f'{len(samples)} profiles in {elapsed:.1f} s '
+              f'({len(samples)/elapsed:.0f} profiles/s) to {args.out}')
+
+
+if __name__ == '__main__':
+    main()
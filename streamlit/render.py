@@ -0,0 +1,122 @@
+'''Raster rendering of diffraction meshes without matplotlib figures
+
+The 'Blues' colormap is applied as a 256-entry lookup table straight to
+a uint8 image, which is optionally downsampled to the display size and
+encoded as PNG or WebP for st.image.
+
+    python render.py
+
+times it against the pcolormesh path of streamDiffraction.py.
+'''
+from typing import Dict, Optional
+from functools import lru_cache
+import io
+import time
+import numpy as np
+from PIL import Image
+import metrics
+
+
+# display size of the image in the app, in pixels
+DISPLAY_SIZE: int = 700
+
+
+@lru_cache(maxsize=None)
+def colormap_lut(name: str = 'Blues') -> np.ndarray:
+    '''(256, 3) uint8 RGB lookup table of a matplotlib colormap'''
+    import matplotlib.pyplot as plt
+
+    colors = plt.get_cmap(name)(np.linspace(0.0, 1.0, 256))[:, :3]
+    lut = np.rint(colors*255).astype(np.uint8)
+    lut.flags.writeable = False
+    return lut
+
+
+def to_image(
+        mesh: np.ndarray, size: Optional[int] = None, cmap: str = 'Blues'
+        ) -> np.ndarray:
+    '''(rows, columns, 3) uint8 RGB of mesh, scaled from min to max as
+    pcolormesh does, row 0 at the bottom, downsampled to size pixels'''
+    low, high = float(mesh.min()), float(mesh.max())
+    if high > low:
+        index = np.rint((mesh - low)*(255.0/(high - low))).astype(np.uint8)
+    else:
+        index = np.zeros(mesh.shape, dtype=np.uint8)
+    rgb = colormap_lut(cmap)[index[::-1]]
+    if size is not None and size < max(mesh.shape):
+        rgb = np.asarray(Image.fromarray(rgb).resize((size, size),
+                                                     Image.BOX))
+    return rgb
+
+
+def encode_image(rgb: np.ndarray, image_format: str = 'PNG') -> bytes:
+    '''PNG or WebP bytes of an RGB image, ready for st.image'''
+    buffer = io.BytesIO()
+    options = {'compress_level': 1} if image_format == 'PNG' \
+        else {'quality': 90}
+    Image.fromarray(rgb).save(buffer, format=image_format, **options)
+    return buffer.getvalue()
+
+
+def render(
+        mesh: np.ndarray, size: Optional[int] = DISPLAY_SIZE,
+        image_format: str = 'PNG'
+        ) -> bytes:
+    '''encoded image of a diffraction mesh'''
+    with metrics.timer('render/colormap'):
+        rgb = to_image(mesh, size)
+    with metrics.timer('render/encode'):
+        return encode_image(rgb, image_format)
+
+
+def matplotlib_render(radius_spacing: np.ndarray,
+                      diffraction_spacing: np.ndarray,
+                      mesh: np.ndarray) -> bytes:
+    '''PNG of the pcolormesh figure streamDiffraction.py draws'''
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots()
+    ax.pcolormesh(radius_spacing, diffraction_spacing, mesh, cmap='Blues',
+                  shading='auto')
+    ax.axis('equal')
+    ax.set_xticks([])
+    ax.set_yticks([])
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png')
+    plt.close(fig)
+    return buffer.getvalue()
+
+
+def compare_render_times(mesh: np.ndarray, repeats: int = 5
+                         ) -> Dict[str, float]:
+    '''best-of-repeats seconds to an encoded image, per render path'''
+    axis = np.linspace(-1.0, 1.0, mesh.shape[0])
+    paths = {
+        'matplotlib': lambda: matplotlib_render(axis, axis, mesh),
+        'lut png': lambda: render(mesh, DISPLAY_SIZE, 'PNG'),
+        'lut webp': lambda: render(mesh, DISPLAY_SIZE, 'WEBP'),
+        'lut png full size': lambda: render(mesh, None, 'PNG'),
+    }
+    times = {}
+    for name, path in paths.items():
+        path()
+        best = np.inf
+        for _ in range(repeats):
+            start = time.perf_counter()
+            path()
+            best = min(best, time.perf_counter() - start)
+        times[name] = best
+    return times
+
+
+if __name__ == '__main__':
+    from core import diffract_plot, factor_lookup
+
+    _, _, mesh = diffract_plot(20, 3, 3, 10.0, 'Contrast', 'Yes',
+                               int(factor_lookup(20, 3)))
+    times = compare_render_times(mesh)
+    for name, seconds in times.items():
+        print(f'{name:>18}: {seconds*1000:8.1f} ms '
+              f"({times['matplotlib']/seconds:5.1f}x)")
@@ -0,0 +1,188 @@
+'''Endless augmented training samples, simulated while training
+
+    with SampleStream(batch_size=1000, workers=4) as stream:
+        for batch in stream:  # (batch_size, SAMPLE_WIDTH) float32
+            ...
+
+Worker processes draw samples as generate_dataset.py does (chiralities of
+indices.csv, a grid of scales, up to MAX_TUBES tubes with fractions
+A_1...A_3), each from its own seed, and mix the clean axial profiles of
+their tubes. Every sample is then augmented (tube tilt, beam broadening,
+shot and read noise, intensity gain with detector saturation) before the
+rows, in the layout of the generated shards, go to the training loop
+through a bounded queue; workers stay at most `prefetch` batches ahead.
+
+    python sample_stream.py --workers 4
+
+measures the samples per second it delivers.
+'''
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+import argparse
+import multiprocessing
+import time
+import numpy as np
+import scipy.fft
+from generate_dataset import MAX_TUBES, SAMPLE_WIDTH, chirality_classes, \
+        sample_specs, write_labels
+from mixture import ProfileBank
+from pattern import PROFILE_LENGTH
+
+
+# batches each worker may have waiting in the queue
+PREFETCH: int = 4
+
+
+class Augmentation(NamedTuple):
+    '''ranges every sample's augmentation is drawn from uniformly'''
+    max_tilt: float = 10.0  # tube tilt out of the image plane, degrees
+    max_broadening: float = 3.0  # Gaussian beam sigma, profile points
+    dose: Tuple[float, float] = (200.0, 5000.0)  # counts at the peak
+    read_noise: float = 0.01  # Gaussian sigma, fraction of the peak
+    gain: Tuple[float, float] = (0.8, 1.2)  # clipped at 1 (saturation)
+
+
+def tilt(profiles: np.ndarray, angle: np.ndarray) -> np.ndarray:
+    '''stretch every row about its center by 1/cos(angle), as a tilted
+    tube spreads its layer lines along the axis'''
+    length = profiles.shape[-1]
+    center = (length - 1)/2
+    source = center + (np.arange(length) - center)*np.cos(angle)[:, None]
+    low = np.floor(source).astype(int)
+    weight = (source - low).astype(profiles.dtype)
+    rows = np.arange(len(profiles))[:, None]
+    return ((1 - weight)*profiles[rows, low]
+            + weight*profiles[rows, np.minimum(low+1, length-1)])
+
+
+def broaden(profiles: np.ndarray, sigma: np.ndarray) -> np.ndarray:
+    '''Gaussian blur of every row with its own sigma, in one FFT'''
+    length = profiles.shape[-1]
+    # zero padded to at least twice the length, so rows do not wrap around
+    padded = scipy.fft.next_fast_len(2*length, real=True)
+    frequency = np.fft.rfftfreq(padded)
+    spectrum = scipy.fft.rfft(profiles, n=padded)
+    spectrum *= np.exp(-2*(np.pi*sigma[:, None]*frequency)**2)
+    return scipy.fft.irfft(spectrum, n=padded)[:, :length]
+
+
+def normalise(profiles: np.ndarray) -> np.ndarray:
+    '''every row scaled to peak 1, empty rows left at 0'''
+    peak = profiles.max(axis=1, keepdims=True)
+    return profiles/np.where(peak > 0, peak, 1.0)
+
+
+def augment(
+        profiles: np.ndarray, rng: np.random.Generator,
+        augmentation: Augmentation = Augmentation()
+        ) -> np.ndarray:
+    '''augmented, peak normalised copy of (samples, PROFILE_LENGTH) rows'''
+    samples = len(profiles)
+    angle = np.radians(rng.uniform(0.0, augmentation.max_tilt, samples))
+    sigma = rng.uniform(0.0, augmentation.max_broadening, samples)
+    profiles = normalise(broaden(tilt(profiles, angle), sigma))
+    np.maximum(profiles, 0.0, out=profiles)
+
+    dose = rng.uniform(*augmentation.dose, samples)[:, None]
+    profiles = rng.poisson(profiles*dose)/dose
+    profiles += rng.normal(0.0, augmentation.read_noise, profiles.shape)
+    np.maximum(profiles, 0.0, out=profiles)
+    gain = rng.uniform(*augmentation.gain, samples)[:, None]
+    return np.minimum(normalise(profiles)*gain, 1.0)
+
+
+def augmented_batch(
+        bank: ProfileBank, batch_size: int, rng: np.random.Generator,
+        augmentation: Augmentation = Augmentation(),
+        max_tubes: int = MAX_TUBES, fraction_steps: int = 12
+        ) -> np.ndarray:
+    '''(batch_size, SAMPLE_WIDTH) float32 rows of fresh samples'''
+    classes, fractions, scale = sample_specs(
+            batch_size, len(bank.table), bank.scales, max_tubes,
+            fraction_steps, seed=int(rng.integers(2**63))
+            )
+    mixed = bank.mix(classes, fractions, bank.scale_index(scale))
+    out = np.empty((batch_size, SAMPLE_WIDTH), dtype=np.float32)
+    out[:, :PROFILE_LENGTH] = augment(mixed, rng, augmentation)
+    write_labels(classes, fractions, scale, out)
+    return out
+
+
+def _produce(
+        batches: multiprocessing.Queue, seed: np.random.SeedSequence,
+        batch_size: int, scales: np.ndarray, augmentation: Augmentation,
+        max_tubes: int, fraction_steps: int, num_layer_lines: int
+        ) -> None:
+    '''worker: put augmented batches until the stream is closed'''
+    rng = np.random.default_rng(seed)
+    bank = ProfileBank(chirality_classes(), scales, num_layer_lines)
+    while True:
+        batches.put(augmented_batch(bank, batch_size, rng, augmentation,
+                                    max_tubes, fraction_steps))
+
+
+class SampleStream:
+    '''endless iterator of augmented batches simulated by worker processes
+
+    Workers are started with 'spawn', which is safe after tensorflow has
+    been imported by the training process.
+    '''
+
+    def __init__(
+            self, batch_size: int = 1000,
+            scales: np.ndarray = np.linspace(5.0, 20.0, 16),
+            augmentation: Augmentation = Augmentation(),
+            workers: int = 4, prefetch: int = PREFETCH,
+            max_tubes: int = MAX_TUBES, fraction_steps: int = 12,
+            num_layer_lines: int = 3, seed: int = 0
+            ):
+        context = multiprocessing.get_context('spawn')
+        self._batches = context.Queue(maxsize=prefetch*workers)
+        self._workers: List[multiprocessing.Process] = [
+                context.Process(
+                    target=_produce, daemon=True,
+                    args=(self._batches, worker_seed, batch_size,
+                          np.asarray(scales, dtype=float), augmentation,
+                          max_tubes, fraction_steps, num_layer_lines))
+                for worker_seed in np.random.SeedSequence(seed).spawn(workers)
+                ]
+        for worker in self._workers:
+            worker.start()
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        while True:
+            yield self._batches.get()
+
+    def close(self) -> None:
+        for worker in self._workers:
+            worker.terminate()
+        for worker in self._workers:
+            worker.join()
+
+    def __enter__(self) -> 'SampleStream':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--batches', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args(argv)
+
+    with SampleStream(args.batch_size, workers=args.workers) as stream:
+        batches = iter(stream)
+        # the first batches pay for filling the profile banks
+        for _ in range(2*args.workers):
+            next(batches)
+        start = time.perf_counter()
+        for _ in range(args.batches):
+            next(batches)
+        rate = args.batches*args.batch_size/(time.perf_counter() - start)
+    print(f'{rate:.0f} samples/s from {args.workers} workers')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,19 @@
+import os
+import time
 import numpy as np
+import pandas as pd
 import matplotlib.pyplot as plt
 import streamlit as st
 from helper import diffract_plot, chiralIndices, chiralAngle, \
-        diameter, read_markdown_file, fact_dict_loader
+        diameter, read_markdown_file, factor_lookup, load_predictor, \
+        load_spacing_index, load_prefetcher, load_profile_matcher, \
+        radial_axis
+from inference import MODEL_DIR, normalise_profile, read_profile
+from lookup import MAX_INDEX
+from mixture import mixture_pattern
+import metrics
+from prefetch import INDEX_RANGE, SliderState
+from render import render
 
 
 unc_svg = '''
@@ -13,6 +24,7 @@ PAGE_CONFIG = {"page_title": "Chiral Indices of CNTs",
                "page_icon": unc_svg,
                "layout": "centered"}  # compare w/ "wide"
 st.beta_set_page_config(**PAGE_CONFIG)
+rerun_start = time.perf_counter()
 st.set_option('deprecation.showPyplotGlobalUse', False)
 # set page title
 st.title('Electron diffraction of carbon nanotube given chiral indices')
@@ -35,6 +47,70 @@ To save an image, right click and save (on Desktop) or press and hold (on mobile
 st.markdown(intro_markdown, unsafe_allow_html=True)
 st.markdown("---")
 
+st.sidebar.markdown("## Mode")
+mode = st.sidebar.radio(
+        'Simulate a pattern or identify an uploaded one',
+        ('Simulate', 'Identify')
+        )
+st.sidebar.markdown("---")
+
+if mode == 'Identify':
+    st.markdown('Upload the 4501-point diffraction profile of a nanotube, '
+                'or its diffraction image, to predict its chiral indices '
+                'with the convolutional neural network.')
+    uploaded = st.file_uploader(
+            'Diffraction profile (.npy, .csv or .txt) or image (.npy, '
+            '.tif, .png or .jpg)',
+            type=['npy', 'csv', 'txt', 'tif', 'tiff', 'png', 'jpg', 'jpeg']
+            )
+    top_k = st.sidebar.slider('Number of candidates', 1, 10, 3)
+    if uploaded is not None:
+        try:
+            profile = read_profile(uploaded)
+        except Exception as e:
+            st.markdown(f'Could not read the uploaded profile. {e}')
+            st.stop()
+        try:
+            predictions = load_predictor(str(MODEL_DIR)).predict(
+                    profile, k=top_k
+                    )
+            st.table(pd.DataFrame(predictions,
+                                  columns=predictions[0]._fields))
+        except Exception as e:
+            st.markdown(f'Could not identify the profile with the model '
+                        f'from {MODEL_DIR}. {e}')
+        # a second opinion: simulated profiles of every chirality,
+        # scale fitted, ranked by cross-correlation with the upload
+        st.markdown('Best matching simulated profiles:')
+        try:
+            matcher = load_profile_matcher()
+            measured = normalise_profile(profile)
+            candidates = matcher.match(measured, k=top_k)
+            st.table(pd.DataFrame(candidates,
+                                  columns=candidates[0]._fields))
+            caveat = matcher.caveat(measured, candidates)
+            if caveat is not None:
+                st.warning(caveat)
+        except Exception as e:
+            st.markdown(f'Could not match the profile with simulated '
+                        f'profiles. {e}')
+
+    st.markdown("---")
+    st.markdown('Or enter the measured spacings of layer lines l₁, l₂ and '
+                'l₃ from the center (any unit) for an analytic lookup.')
+    spacings = [st.number_input(f'D{i}', 0.0, value=0.0, key=f'D{i}')
+                for i in (1, 2, 3)]
+    measured_diameter = st.number_input(
+            'Diameter in nm (0 if unknown)', 0.0, value=0.0
+            )
+    if all(spacing > 0 for spacing in spacings):
+        matches = load_spacing_index(MAX_INDEX).query(
+                spacings, None if measured_diameter == 0
+                else measured_diameter, k=top_k
+                )
+        st.table(pd.DataFrame(matches, columns=matches[0]._fields))
+    st.stop()
+
 st.sidebar.markdown("## Plot Details")
 st.sidebar.markdown("① ** Diffraction intensity **")
 option = st.sidebar.selectbox(
@@ -47,28 +123,75 @@ scale = st.sidebar.slider(
         "Scale as fraction of 0.246 nm (smaller # is more 'zoomed' in)",
         0.1, 50.0, 10.0, 0.1
         )
+# the slider's floats can be off its 0.1 steps; prefetch rounds them too
+scale = round(scale, 1)
 st.sidebar.markdown("---")
 st.sidebar.markdown("③ ** Include center layer line (l₀) **")
 lines = st.sidebar.selectbox('Include center layer line', ('Yes', 'No'))
+st.sidebar.markdown("---")
+st.sidebar.markdown("④ ** Number of layer lines **")
+num_layer_lines = st.sidebar.slider(
+        'Layer lines l₁, l₂, ... by reciprocal lattice distance',
+        1, 20, 3, 1
+        )
+st.sidebar.markdown("---")
+st.sidebar.markdown("⑤ ** Renderer **")
+renderer = st.sidebar.selectbox(
+        'Fast image or matplotlib figure?', ('Fast', 'Matplotlib')
+        )
+st.sidebar.markdown("---")
+st.sidebar.markdown("⑥ ** Debug **")
+show_timings = st.sidebar.checkbox('Show stage timings')
+if show_timings:
+    # stays on for the process; $CNT_METRICS=1 turns it on at start
+    metrics.enable()
 
 
-chiral_n = st.number_input("Chiral indice n", 0, 24, 20, 1)
-chiral_m = st.number_input("Chiral indice m", 0, 24, 3, 1)
+chiral_n = st.number_input("Chiral indice n", *INDEX_RANGE, 20, 1)
+chiral_m = st.number_input("Chiral indice m", *INDEX_RANGE, 3, 1)
 indices = chiralIndices(chiral_n, chiral_m)
 
-with st.spinner(text='Plotting new state'):
-    # get pre-calculated spacing factor, from eqn. (70) in Qin 2006.
-    fact_dict = fact_dict_loader()
+# a bundle superposes further tubes with the first, by relative fractions
+extra_tubes = int(st.number_input("Additional tubes in a bundle", 0, 2, 0, 1))
+tubes, fractions = [indices], [1.0]
+if extra_tubes:
+    fractions[0] = st.number_input("Fraction of tube 1", 0.0, 1.0, 0.5, 0.05)
+for tube in range(2, extra_tubes+2):
+    tubes.append(chiralIndices(
+            int(st.number_input(f"Chiral indice n of tube {tube}",
+                                *INDEX_RANGE, 10, 1)),
+            int(st.number_input(f"Chiral indice m of tube {tube}",
+                                *INDEX_RANGE, 10, 1))
+            ))
+    fractions.append(st.number_input(f"Fraction of tube {tube}",
+                                     0.0, 1.0, 0.5, 0.05))
+if sum(fractions) == 0:
+    st.markdown('The fractions of the bundle must not all be 0.')
+    st.stop()
 
-    if indices.m > indices.n:
-        factor = fact_dict[(indices.n, indices.m)]
-    else:
-        factor = fact_dict[(indices.m, indices.n)]
+with st.spinner(text='Plotting new state'):
+    # spacing factor, from eqn. (70) in Qin 2006.
+    factor = int(factor_lookup(indices.n, indices.m))
+    state = SliderState(indices.n, indices.m, num_layer_lines, scale,
+                        option, lines)
+    prefetcher = load_prefetcher()
 
     try:
-        radius_spacing, diffraction_spacing, total_mesh = diffract_plot(
-                indices.n, indices.m, 3, scale, option, lines, factor
-                )
+        prefetcher.wait(state)
+        if len(tubes) > 1:
+            # only the axes of tube 1, its mesh is summed in the mixture
+            radius_spacing = radial_axis(indices, scale)
+            diffraction_spacing = radius_spacing.copy()
+            with metrics.timer('app/mixture'):
+                total_mesh = mixture_pattern(
+                        tubes, fractions, num_layer_lines, scale, option,
+                        lines
+                        )
+        else:
+            with metrics.timer('app/diffract_plot'):
+                radius_spacing, diffraction_spacing, total_mesh = \
+                    diffract_plot(indices.n, indices.m, num_layer_lines,
+                                  scale, option, lines, factor)
     except Exception as e:
         st.markdown(
                 'Could not make diffraction plot for the chiral indices. '
@@ -77,19 +200,52 @@ with st.spinner(text='Plotting new state'):
                 )
         radius_spacing, diffraction_spacing = np.zeros(1000), np.zeros(1000)
         total_mesh = np.zeros((1000, 1000))
-    plt.xticks([])
-    plt.yticks([])
-    plt.title(f'Chiral indices: [{indices.n},{indices.m}]      Diameter: {round(diameter(indices), 3)}   Helicity: {round(chiralAngle(indices)*180/np.pi, 3)} degrees')
-    plt.pcolormesh(
-            radius_spacing, diffraction_spacing, total_mesh, cmap='Blues'
-            )
-    plt.axis('equal')
-    for spine in plt.gca().spines.values():
-        spine.set_visible(False)
-    plt.tick_params(
-            top='off', bottom='off', left='off',
-            right='off', labelleft='off', labelbottom='on'
-            )
-
-    plt.show()
-    st.pyplot()
+    # the next nudge of scale, n or m is likely cached by then
+    prefetcher.prefetch(state)
+    if len(tubes) > 1:
+        title = 'Bundle: ' + ',  '.join(
+                f'[{tube.n},{tube.m}] {fraction/sum(fractions):.0%}'
+                for tube, fraction in zip(tubes, fractions)
+                )
+    else:
+        title = f'Chiral indices: [{indices.n},{indices.m}]      Diameter: {round(diameter(indices), 3)}   Helicity: {round(chiralAngle(indices)*180/np.pi, 3)} degrees'
+    if renderer == 'Fast':
+        # colormap lookup straight to an image, no figure is drawn
+        st.markdown(f'**{title}**')
+        with metrics.timer('app/render'):
+            image = render(total_mesh)
+        with metrics.timer('app/st.image'):
+            st.image(image, use_column_width=True)
+    else:
+        with metrics.timer('app/pcolormesh'):
+            plt.xticks([])
+            plt.yticks([])
+            plt.title(title)
+            plt.pcolormesh(
+                    radius_spacing, diffraction_spacing, total_mesh,
+                    cmap='Blues'
+                    )
+            plt.axis('equal')
+            for spine in plt.gca().spines.values():
+                spine.set_visible(False)
+            plt.tick_params(
+                    top='off', bottom='off', left='off',
+                    right='off', labelleft='off', labelbottom='on'
+                    )
+
+        with metrics.timer('app/st.pyplot'):
+            plt.show()
+            st.pyplot()
+
+metrics.record('app/rerun', time.perf_counter() - rerun_start)
+if show_timings:
+    result = metrics.snapshot()
+    st.sidebar.markdown('Stage timings of this process, in ms')
+    st.sidebar.table(pd.DataFrame.from_dict(
+            result['stages'], orient='index'
+            )[['calls', 'last_ms', 'mean_ms', 'p95_ms']].round(3))
+    if result['counters']:
+        st.sidebar.table(pd.Series(result['counters'], name='count'))
+if metrics.enabled() and os.environ.get('CNT_METRICS_FILE'):
+    # machine-readable, replaced after every rerun
+    metrics.dump(os.environ['CNT_METRICS_FILE'])
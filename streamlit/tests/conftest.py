@@ -0,0 +1,5 @@
+'''the app's modules are imported flat from streamlit/'''
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
@@ -0,0 +1,14 @@
+import numpy as np
+import pytest
+from scipy.special import jv
+from bessel import bessel_table
+
+
+@pytest.mark.parametrize('max_order', [0, 1, 4, 30, 60])
+def test_bessel_table_matches_scipy(max_order):
+    # both sides of zero, below the order (backward recurrence) and above
+    x = np.concatenate([np.linspace(-200.0, 200.0, 4001), [0.0, 1e-8]])
+    table = bessel_table(max_order, x)
+    assert table.shape == (max_order+1, len(x))
+    expected = jv(np.arange(max_order+1)[:, None], x)
+    assert np.max(np.abs(table - expected)) < 1e-13
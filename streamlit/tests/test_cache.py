@@ -0,0 +1,81 @@
+import os
+import numpy as np
+import pytest
+import cache
+from cache import MISSING, DiskCache, LRUCache, TieredCache, cached
+
+
+def value(i):
+    return {'i': i, 'mesh': np.full((64, 64), float(i)), 'name': f'v{i}'}
+
+
+def same(a, b):
+    return a['i'] == b['i'] and a['name'] == b['name'] \
+        and np.array_equal(a['mesh'], b['mesh'])
+
+
+def test_disk_round_trip(tmp_path):
+    disk = DiskCache(tmp_path)
+    assert disk.get('a') is MISSING
+    disk.set('a', value(1))
+    loaded = disk.get('a')
+    assert same(loaded, value(1))
+    # arrays come back memory-mapped and read-only
+    assert isinstance(loaded['mesh'], np.memmap)
+    with pytest.raises(ValueError):
+        loaded['mesh'][0, 0] = 0
+    # other processes see the entry through the directory
+    assert same(DiskCache(tmp_path).get('a'), value(1))
+    disk.clear()
+    assert disk.get('a') is MISSING
+
+
+def test_disk_evicts_least_recently_used(tmp_path):
+    disk = DiskCache(tmp_path, max_bytes=10**9)
+    for i, key in enumerate('abc'):
+        disk.set(key, value(i))
+        os.utime(tmp_path / key, (i, i))
+    entry = max(size for _, size, _ in disk.entries())
+    disk.max_bytes = 2*entry
+    disk.get('a')  # now the most recently used
+    disk.set('d', value(3))
+    assert disk.get('b') is MISSING and disk.get('c') is MISSING
+    assert same(disk.get('a'), value(0)) and same(disk.get('d'), value(3))
+    assert sum(size for _, size, _ in disk.entries()) <= disk.max_bytes
+
+
+def test_lru_evicts_least_recently_used():
+    lru = LRUCache(2)
+    lru.set('a', 1)
+    lru.set('b', 2)
+    lru.get('a')
+    lru.set('c', 3)
+    assert (lru.get('a'), lru.get('b'), lru.get('c')) == (1, MISSING, 3)
+
+
+def test_tiered_keeps_slow_hits_in_the_fast_cache(tmp_path):
+    tiered = TieredCache(LRUCache(1), DiskCache(tmp_path))
+    tiered.set('a', value(1))
+    tiered.set('b', value(2))
+    assert tiered.fast.get('a') is MISSING
+    assert same(tiered.get('a'), value(1))
+    assert same(tiered.fast.get('a'), value(1))
+    tiered.clear()
+    assert tiered.get('a') is MISSING and tiered.slow.get('b') is MISSING
+
+
+def test_cached_through_a_tiered_backend(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, '_backend',
+                        TieredCache(LRUCache(4), DiskCache(tmp_path)))
+    calls = []
+
+    @cached
+    def square(x, power=2):
+        calls.append(x)
+        return np.arange(x)**power
+
+    assert np.array_equal(square(3), [0, 1, 4])
+    assert np.array_equal(square(x=3, power=2), [0, 1, 4])
+    cache.get_backend().fast.clear()
+    assert np.array_equal(square(3), [0, 1, 4])
+    assert calls == [3]
@@ -0,0 +1,61 @@
+import numpy as np
+import core
+from bessel import bessel_table
+from core import INDICES_CSV, bessel_orders, chiralIndices, \
+        clear_layer_lines, factor_lookup, factor_table, layer_line_profiles, \
+        spacing_factor
+
+
+def calibrated():
+    key_value = np.loadtxt(INDICES_CSV, delimiter=',', ndmin=2).astype(int)
+    return key_value[:, 0], key_value[:, 1], key_value[:, 2]
+
+
+def test_factor_table_reproduces_calibration():
+    chiral_n, chiral_m, factor = calibrated()
+    assert np.array_equal(factor_lookup(chiral_n, chiral_m), factor)
+    assert np.array_equal(factor_lookup(chiral_m, chiral_n), factor)
+
+
+def test_factor_table_continuous_past_calibration():
+    chiral_n, chiral_m, _ = calibrated()
+    top = int(np.max([chiral_n, chiral_m]))
+    table = factor_table(64)
+    low = np.arange(top+1)
+    # one step out changes the factor as much as the closed form does
+    expected = table[low, top]*spacing_factor(top+1, low) \
+        / spacing_factor(top, low)
+    assert np.all(np.abs(table[low, top+1] - expected) <= 1)
+    assert abs(table[top+1, top+1] - table[top, top]
+               * spacing_factor(top+1, top+1)/spacing_factor(top, top)) <= 1
+
+
+def test_factor_extrapolation_predicts_calibrated_cells():
+    # the calibration of (low, top-1) carried out to (low, top), as the
+    # table does past top, against the calibrated factor there
+    chiral_n, chiral_m, _ = calibrated()
+    top = int(np.max([chiral_n, chiral_m]))
+    table = factor_table(64)
+    low = np.arange(top)
+    predicted = table[low, top-1]*spacing_factor(top, low) \
+        / spacing_factor(top-1, low)
+    assert np.all(np.abs(predicted/table[low, top] - 1) < 0.06)
+
+
+def test_layer_line_profiles_only_evaluate_new_orders(monkeypatch):
+    calls = []
+
+    def table(max_order, x):
+        calls.append(max_order)
+        return bessel_table(max_order, x)
+
+    monkeypatch.setattr(core, 'bessel_table', table)
+    clear_layer_lines()
+    four = layer_line_profiles(13, 7, 25.0, num_layer_lines=4)
+    five = layer_line_profiles(13, 7, 25.0, num_layer_lines=5)
+    new = set(five) - set(four)
+    assert new and calls == [max(four), max(new)]
+    assert all(five[order] is four[order] for order in four)
+    again = layer_line_profiles(13, 7, 25.0, num_layer_lines=5)
+    assert len(calls) == 2 and all(again[o] is five[o] for o in five)
+    assert set(five) == set(bessel_orders(chiralIndices(13, 7), 5))
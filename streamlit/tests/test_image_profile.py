@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+import scipy.ndimage
+from core import diffract_plot, factor_lookup
+from image_profile import extract_profile
+from pattern import PROFILE_LENGTH
+
+
+@pytest.fixture(scope='module')
+def frame():
+    '''2000 x 2000 image of a pattern filling the frame, axis vertical,
+    and its simulated profile'''
+    _, _, mesh = diffract_plot(20, 3, 3, 10.0, 'Linear', 'Yes',
+                               int(factor_lookup(20, 3)))
+    profile = np.interp(np.linspace(0, len(mesh)-1, PROFILE_LENGTH),
+                        np.arange(len(mesh)), mesh.mean(axis=1))
+    return scipy.ndimage.zoom(mesh, 2, order=1), profile
+
+
+@pytest.mark.parametrize('degrees', [0, 12, 30])
+def test_profile_does_not_depend_on_rotation(frame, degrees):
+    image, simulated = frame
+    rotated = scipy.ndimage.rotate(image, degrees, reshape=False, order=1)
+    result = extract_profile(rotated)
+    assert result.extent == pytest.approx(1000, abs=1)
+    assert np.corrcoef(result.profile, simulated)[0, 1] > 0.98
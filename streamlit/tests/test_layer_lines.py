@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+from core import chiralAngle, chiralIndices, spacingD1, spacingD2, \
+        spacingD3, spacingD4
+from layer_lines import layer_line_orders, layer_line_spacings, reflections
+
+
+def test_first_reflections_are_l0_to_l4():
+    assert reflections(4).tolist() == [[0, 0], [0, 1], [-1, 0], [1, 1],
+                                       [-1, 1]]
+
+
+@pytest.mark.parametrize('num_layer_lines', [4, 10, 40])
+def test_reflections_are_one_of_each_pair_by_length(num_layer_lines):
+    hk = reflections(num_layer_lines)
+    assert len(hk) == num_layer_lines + 1
+    pairs = {tuple(r) for r in hk} | {tuple(-r) for r in hk}
+    assert len(pairs) == 2*len(hk) - 1  # (0, 0) is its own mirror
+    h, k = hk.T
+    assert np.all(np.diff(h*h - h*k + k*k) >= 0)
+    # more lines only add to the end
+    assert np.array_equal(reflections(num_layer_lines + 3)[:len(hk)], hk)
+
+
+@pytest.mark.parametrize('chiral_n, chiral_m', [(20, 3), (13, 7), (0, 1),
+                                                (8, 8)])
+def test_orders_and_spacings_of_l1_to_l4(chiral_n, chiral_m):
+    hk = reflections(4)
+    orders = layer_line_orders(hk, chiral_n, chiral_m)
+    assert orders.tolist() == [0, chiral_m, chiral_n, chiral_n + chiral_m,
+                               abs(chiral_m - chiral_n)]
+    angle = chiralAngle(chiralIndices(chiral_n, chiral_m))
+    spacings = layer_line_spacings(hk, angle, 1.0)
+    assert np.allclose(spacings, [0, spacingD1(angle, 1.0),
+                                  spacingD2(angle, 1.0),
+                                  spacingD3(angle, 1.0),
+                                  spacingD4(angle, 1.0)])
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+from batch import batch_patterns, load_indices
+from core import factor_lookup
+from matching import ProfileMatcher, main
+from pattern import PROFILE_LENGTH
+
+
+@pytest.fixture(scope='module')
+def bank(tmp_path_factory):
+    path = tmp_path_factory.mktemp('matching') / 'bank.npz'
+    main(['build', str(path)])
+    return path
+
+
+def test_bank_holds_every_chirality_once(bank):
+    matcher = ProfileMatcher.load(bank)
+    chiralities = set(zip(matcher.n.tolist(), matcher.m.tolist()))
+    assert len(chiralities) == len(matcher.n)
+    assert chiralities == set(zip(*load_indices()[:2]))
+
+
+def test_match_cli_reads_a_saved_profile(bank, tmp_path, capsys):
+    pattern, = batch_patterns(20, 3, 12.0, factor_lookup(20, 3), half=True)
+    path = tmp_path / 'profile.npy'
+    np.save(path, pattern.axial_profile())
+    capsys.readouterr()
+    main(['match', str(path), '--bank', str(bank), '-k', '5'])
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 5
+    # indices.csv lists each chirality as n <= m
+    matches = [tuple(sorted(int(i) for i in
+                            line[1:line.index(')')].split(',')))
+               for line in lines]
+    assert len(set(matches)) == 5
+    assert (3, 20) in matches
+
+
+def test_flat_profile_is_flagged(bank):
+    matcher = ProfileMatcher.load(bank)
+    for profile in (np.zeros(PROFILE_LENGTH), np.ones(PROFILE_LENGTH)):
+        candidates = matcher.match(profile)
+        assert matcher.caveat(profile, candidates) is not None
+    # exact ties keep the bank order
+    ranked = [(c.n, c.m) for c in matcher.match(np.zeros(PROFILE_LENGTH))]
+    assert ranked == list(zip(matcher.n[:5].tolist(), matcher.m[:5].tolist()))
+
+
+def test_tied_chiralities_are_flagged(bank):
+    matcher = ProfileMatcher.load(bank)
+    pattern, = batch_patterns(20, 3, 12.0, factor_lookup(20, 3), half=True)
+    profile = pattern.axial_profile()
+    assert matcher.caveat(profile, matcher.match(profile)) is None
+    # a second chirality with the same simulated profiles as (3, 20)
+    best = np.flatnonzero((matcher.n == 3) & (matcher.m == 20))[0]
+    twin = ProfileMatcher(np.r_[matcher.n, 99], np.r_[matcher.m, 99],
+                          matcher.scales,
+                          np.concatenate([matcher.bank,
+                                          matcher.bank[best, None]]),
+                          matcher.radius_range)
+    candidates = twin.match(profile)
+    assert {(c.n, c.m) for c in candidates[:2]} == {(3, 20), (99, 99)}
+    assert twin.caveat(profile, candidates) is not None
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+from batch import batch_patterns
+from core import diffract_pattern, factor_lookup
+from pattern import PROFILE_LENGTH
+
+
+def projection(mesh):
+    rows = mesh.sum(axis=1)
+    return np.interp(np.linspace(0, len(rows)-1, PROFILE_LENGTH),
+                     np.arange(len(rows)), rows)
+
+
+@pytest.mark.parametrize('half', [False, True])
+@pytest.mark.parametrize('chiral_n, chiral_m, scale', [
+        (20, 3, 10.0),
+        (13, 7, 25.0),
+        # l1 falls off the plot, its rows are negative
+        (0, 1, 5.0)])
+def test_axial_profile_is_projection_of_dense(chiral_n, chiral_m, scale,
+                                              half):
+    pattern, = batch_patterns(chiral_n, chiral_m, scale,
+                              factor_lookup(chiral_n, chiral_m), half=half)
+    assert np.allclose(pattern.axial_profile(), projection(pattern.dense()))
+
+
+@pytest.mark.parametrize('option', ['Linear', 'Contrast'])
+@pytest.mark.parametrize('chiral_n, chiral_m, scale, num_layer_lines', [
+        (20, 3, 10.0, 3),
+        (13, 7, 25.0, 5),
+        (0, 1, 5.0, 4)])
+def test_half_pattern_mirrors_into_full(chiral_n, chiral_m, scale,
+                                        num_layer_lines, option):
+    full, half = (diffract_pattern(chiral_n, chiral_m, num_layer_lines,
+                                   scale, option, 'Yes',
+                                   int(factor_lookup(chiral_n, chiral_m)),
+                                   half=half)
+                  for half in (False, True))
+    # the full radial axis differs from the mirrored half by roundoff
+    assert np.allclose(half.dense(), full.dense())
+    # and the mesh is symmetric about both axes of the plot
+    mesh = half.dense()
+    assert np.array_equal(mesh, mesh[::-1, ::-1])
@@ -0,0 +1,91 @@
+import threading
+import time
+import pytest
+import cache
+import prefetch
+from cache import LRUCache, NoCache
+from prefetch import INDEX_RANGE, Prefetcher, SliderState, neighbours, \
+        simulate
+
+
+STATE = SliderState(20, 3, 3, 10.0, 'Linear', 'Yes')
+
+
+class RecordingCache(LRUCache):
+    '''an LRUCache that lists the keys it is given'''
+
+    def __init__(self):
+        super().__init__()
+        self.keys = []
+
+    def set(self, key, value):
+        self.keys.append(key)
+        super().set(key, value)
+
+
+def test_neighbours_nearest_first():
+    states = neighbours(STATE, scale_steps=2)
+    assert [(s.chiral_n, s.chiral_m, s.scale) for s in states] == [
+            (20, 3, 10.1), (20, 3, 9.9), (21, 3, 10.0), (20, 4, 10.0),
+            (19, 3, 10.0), (20, 2, 10.0), (20, 3, 10.2), (20, 3, 9.8)]
+
+
+def test_neighbours_stay_in_the_inputs_range():
+    corner = STATE._replace(chiral_n=0, chiral_m=1, scale=0.1)
+    states = neighbours(corner, scale_steps=1)
+    assert {(s.chiral_n, s.chiral_m, s.scale) for s in states} == {
+            (0, 1, 0.2), (1, 1, 0.1), (0, 2, 0.1)}
+    top = STATE._replace(chiral_n=INDEX_RANGE[1])
+    assert all(s.chiral_n <= INDEX_RANGE[1] for s in neighbours(top))
+
+
+def test_prefetched_states_are_cached(monkeypatch):
+    backend = RecordingCache()
+    monkeypatch.setattr(cache, '_backend', backend)
+    prefetcher = Prefetcher()
+    prefetcher.prefetch(STATE)
+    wanted = neighbours(STATE)
+    # shutdown cancels what has not started, so wait for all of them
+    deadline = time.monotonic() + 60
+    while len(backend.keys) < len(wanted) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    prefetcher.shutdown()
+    assert len(backend.keys) == len(wanted)
+    # the app's reruns of those states are cache hits
+    for state in wanted:
+        simulate(state)
+    assert len(backend.keys) == len(wanted)
+
+
+def test_nothing_is_prefetched_without_a_cache(monkeypatch):
+    monkeypatch.setattr(cache, '_backend', NoCache())
+    monkeypatch.setattr(prefetch, 'simulate', pytest.fail)
+    prefetcher = Prefetcher()
+    prefetcher.prefetch(STATE)
+    prefetcher.shutdown()
+
+
+def test_stale_and_waited_for_states_are_cancelled(monkeypatch):
+    started, release = threading.Event(), threading.Event()
+    simulated = []
+
+    def blocked(state):
+        started.set()
+        release.wait()
+        simulated.append(state)
+
+    monkeypatch.setattr(cache, '_backend', LRUCache())
+    monkeypatch.setattr(prefetch, 'simulate', blocked)
+    prefetcher = Prefetcher(workers=1, scale_steps=1)
+    first, queued, *_ = neighbours(STATE, scale_steps=1)
+    prefetcher.prefetch(STATE)
+    started.wait()
+    # queued has not started, the rerun simulates it itself
+    prefetcher.wait(queued)
+    # a jump away leaves only the running state of the old neighbours
+    far = STATE._replace(chiral_n=5, chiral_m=5)
+    prefetcher.prefetch(far)
+    release.set()
+    prefetcher.shutdown()
+    assert simulated[0] == first
+    assert set(simulated[1:]) <= set(neighbours(far, scale_steps=1))
@@ -0,0 +1,229 @@
+'''Tiled, bounded-memory exports of patterns at any resolution
+
+    python tiles.py 20 3 pattern.png --resolution 16384 --option Contrast
+    python tiles.py 20 3 pattern.npy --resolution 8192
+
+simulates the half pattern of diffract_pattern at the resolution (1D
+layer line profiles, resolution//2 points each) and renders the mesh in
+strips of rows on worker processes, straight to disk: a float32 .npy
+that every worker writes its strips of through a memory map, or an RGB
+PNG (colored as render.py does) whose compressed strips are concatenated
+in order. A strip is at most STRIP_BYTES of mesh, so the memory of a
+worker does not grow with the number of rows, and the export never holds
+the mesh.
+'''
+from typing import List, Optional, Tuple
+from pathlib import Path
+import argparse
+import multiprocessing
+import struct
+import time
+import zlib
+import numpy as np
+from core import diffract_pattern, factor_lookup
+from pattern import LayerLinePattern
+from render import colormap_lut
+
+
+# mesh bytes (float64, as simulated) a worker renders at once
+STRIP_BYTES: int = 2**24
+# zlib level of PNG exports, 1 is several times faster than 6
+PNG_LEVEL: int = 1
+
+
+def row_lines(pattern: LayerLinePattern) -> np.ndarray:
+    '''(size,) profile of every row of the quadrant of a half pattern,
+    -1 for empty rows; later lines overwrite earlier ones, as quadrant()'''
+    size = len(pattern.radius_spacing)
+    lines = np.full(size, -1, dtype=np.int32)
+    half = pattern.band_width//2
+    for i, row in enumerate(np.abs(pattern.pos_rows - size)):
+        lines[max(row-half, 0):row+half] = i
+    return lines
+
+
+def value_range(pattern: LayerLinePattern, lines: np.ndarray
+                ) -> Tuple[float, float]:
+    '''(min, max) of the dense mesh, without building it'''
+    drawn = pattern.profiles[np.unique(lines[lines >= 0])]
+    values = [drawn.min(), drawn.max()] if drawn.size else []
+    if np.any(lines < 0):
+        # empty rows are 0.0 in both intensity modes
+        values.append(0.0)
+    return float(min(values)), float(max(values))
+
+
+class StripRenderer:
+    '''rows of the dense mesh of a half pattern, any strip at a time'''
+
+    def __init__(self, pattern: LayerLinePattern):
+        if not pattern.half:
+            raise ValueError('StripRenderer needs a half pattern')
+        self.size = len(pattern.radius_spacing)
+        self.shape = pattern.shape
+        self.lines = row_lines(pattern)
+        self.low, self.high = value_range(pattern, self.lines)
+        # whole rows of every line, mirrored about the center column
+        self.rows = np.concatenate(
+                [pattern.profiles[:, ::-1], pattern.profiles], axis=1
+                )
+
+    def strip(self, start: int, stop: int) -> np.ndarray:
+        '''(stop-start, columns) rows start...stop of dense()'''
+        rows = np.arange(start, stop)
+        # the upper half mirrors the lower one
+        lines = self.lines[np.where(rows >= self.size, rows - self.size,
+                                    self.size - 1 - rows)]
+        out = np.zeros((len(rows), self.shape[1]), dtype=self.rows.dtype)
+        drawn = lines >= 0
+        out[drawn] = self.rows[lines[drawn]]
+        return out
+
+    def rgb_strip(self, start: int, stop: int, cmap: str = 'Blues'
+                  ) -> np.ndarray:
+        '''(stop-start, columns, 3) uint8 of render.to_image, which puts
+        row 0 at the bottom; the mesh is symmetric, so rows stay put'''
+        mesh = self.strip(start, stop)
+        if self.high > self.low:
+            index = np.rint((mesh - self.low)*(255.0/(self.high - self.low))
+                            ).astype(np.uint8)
+        else:
+            index = np.zeros(mesh.shape, dtype=np.uint8)
+        return colormap_lut(cmap)[index]
+
+
+def strips(rows: int, columns: int, strip_bytes: int = STRIP_BYTES
+           ) -> List[Tuple[int, int]]:
+    '''(start, stop) rows of strips of at most strip_bytes float64'''
+    step = max(strip_bytes//(8*columns), 1)
+    return [(start, min(start+step, rows)) for start in range(0, rows, step)]
+
+
+_renderer: Optional[StripRenderer] = None
+
+
+def _init_worker(pattern: LayerLinePattern) -> None:
+    global _renderer
+    _renderer = StripRenderer(pattern)
+
+
+def _write_npy_strip(task: Tuple[str, int, int]) -> int:
+    path, start, stop = task
+    mesh = np.load(path, mmap_mode='r+')
+    mesh[start:stop] = _renderer.strip(start, stop)
+    mesh.flush()
+    del mesh
+    return stop - start
+
+
+def _png_strip(task: Tuple[int, int, bool]) -> Tuple[bytes, int, int]:
+    '''(raw deflate data, adler32, bytes) of the filtered PNG rows'''
+    start, stop, last = task
+    rgb = _renderer.rgb_strip(start, stop)
+    # filter type 0 (none) before every row
+    raw = np.concatenate([np.zeros((len(rgb), 1), dtype=np.uint8),
+                          rgb.reshape(len(rgb), -1)], axis=1).tobytes()
+    compressor = zlib.compressobj(PNG_LEVEL, zlib.DEFLATED, -15)
+    data = compressor.compress(raw) + compressor.flush(
+            zlib.Z_FINISH if last else zlib.Z_FULL_FLUSH)
+    return data, zlib.adler32(raw), len(raw)
+
+
+def adler32_combine(adler1: int, adler2: int, length2: int) -> int:
+    '''adler32 of two byte strings from theirs, as zlib's
+    adler32_combine'''
+    base = 65521
+    remainder = length2 % base
+    sum1 = adler1 & 0xffff
+    sum2 = (remainder*sum1) % base
+    sum1 = (sum1 + (adler2 & 0xffff) + base - 1) % base
+    sum2 = (sum2 + (adler1 >> 16) + (adler2 >> 16) + base - remainder) \
+        % base
+    return (sum2 << 16) | sum1
+
+
+def _png_chunk(kind: bytes, data: bytes) -> bytes:
+    return (struct.pack('>I', len(data)) + kind + data
+            + struct.pack('>I', zlib.crc32(kind + data)))
+
+
+def export(
+        pattern: LayerLinePattern, path: Path, workers: Optional[int] = None,
+        strip_bytes: int = STRIP_BYTES
+        ) -> Path:
+    '''write the dense mesh of a half pattern to a .npy or .png in
+    strips, rendered on workers processes'''
+    path = Path(path)
+    if path.suffix not in ('.npy', '.png'):
+        raise ValueError(f'export writes .npy or .png, got {path.name}')
+    rows, columns = pattern.shape
+    tasks = strips(rows, columns, strip_bytes)
+    with multiprocessing.Pool(workers, _init_worker, (pattern,)) as pool:
+        if path.suffix == '.npy':
+            np.lib.format.open_memmap(path, mode='w+', dtype=np.float32,
+                                      shape=pattern.shape).flush()
+            for _ in pool.imap_unordered(
+                    _write_npy_strip,
+                    [(str(path), start, stop) for start, stop in tasks]):
+                pass
+            return path
+
+        with open(path, 'wb') as f:
+            f.write(b'\x89PNG\r\n\x1a\n')
+            # 8-bit RGB, not interlaced
+            f.write(_png_chunk(b'IHDR', struct.pack('>IIBBBBB', columns,
+                                                    rows, 8, 2, 0, 0, 0)))
+            # zlib header, then the strips' deflate data in order
+            f.write(_png_chunk(b'IDAT', b'\x78\x01'))
+            checksum = 1
+            for data, adler, length in pool.imap(
+                    _png_strip,
+                    [(start, stop, stop == rows) for start, stop in tasks]):
+                f.write(_png_chunk(b'IDAT', data))
+                checksum = adler32_combine(checksum, adler, length)
+            f.write(_png_chunk(b'IDAT', struct.pack('>I', checksum)))
+            f.write(_png_chunk(b'IEND', b''))
+    return path
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('n', type=int)
+    parser.add_argument('m', type=int)
+    parser.add_argument('out', type=Path, help='.npy or .png')
+    parser.add_argument('--resolution', type=int, default=8192)
+    parser.add_argument('--scale', type=float, default=10.0)
+    parser.add_argument('--num-layer-lines', type=int, default=3)
+    parser.add_argument('--option', choices=('Linear', 'Contrast'),
+                        default='Linear')
+    parser.add_argument('--lines', choices=('Yes', 'No'), default='Yes')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='processes, defaults to the number of cores')
+    args = parser.parse_args(argv)
+    if args.resolution % 2:
+        parser.error('--resolution must be even')
+
+    start = time.perf_counter()
+    pattern = diffract_pattern(
+            args.n, args.m, args.num_layer_lines, args.scale, args.option,
+            args.lines, int(factor_lookup(args.n, args.m)), half=True,
+            resolution=args.resolution
+            )
+    export(pattern, args.out, args.workers)
+    elapsed = time.perf_counter() - start
+    summary = (f'{args.resolution}x{args.resolution} to {args.out} in '
+               f'{elapsed:.1f} s ({args.out.stat().st_size/2**20:.0f} MB)')
+    try:
+        # Unix only
+        import resource
+    except ImportError:
+        print(summary)
+        return
+    # kilobytes on Linux
+    peak = max(resource.getrusage(who).ru_maxrss for who in
+               (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN))
+    print(f'{summary}, peak memory of a process {peak/1024:.0f} MB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+'''Fill the shared disk cache with the app's patterns of indices.csv
+
+    CNT_CACHE_DIR=/shared/cnt-cache python warm_cache.py --scale 10.0
+
+stores diffract_pattern results (see cache.DiskCache) of every (n, m) of
+indices.csv at the scale, for the default number of layer lines and
+every intensity mode and l0 choice, exactly as the app requests them. App
+replicas started with CNT_CACHE=lru+disk and the same CNT_CACHE_DIR then
+serve those chiralities without simulating them, also after a restart.
+'''
+from typing import List, Optional, Sequence
+from pathlib import Path
+import argparse
+import itertools
+import os
+import time
+from batch import load_indices
+from cache import CACHE_BYTES, CACHE_DIR, DiskCache, set_backend
+from core import diffract_pattern, factor_lookup
+
+
+# the app's default scale and number of layer lines
+SCALE: float = 10.0
+NUM_LAYER_LINES: Sequence[int] = (3,)
+OPTIONS: Sequence[str] = ('Linear', 'Contrast')
+LINES: Sequence[str] = ('Yes', 'No')
+
+
+def warm(
+        cache: DiskCache, scale: float = SCALE,
+        num_layer_lines: Sequence[int] = NUM_LAYER_LINES
+        ) -> int:
+    '''simulate every missing pattern into cache, returns the patterns'''
+    set_backend(cache)
+    chiral_n, chiral_m, _ = load_indices(unique=True)
+    patterns = 0
+    for (n, m), num, option, lines in itertools.product(
+            zip(chiral_n.tolist(), chiral_m.tolist()), num_layer_lines,
+            OPTIONS, LINES):
+        # the arguments of diffract_plot's call, so the keys match
+        diffract_pattern(n, m, num, scale, option, lines,
+                         int(factor_lookup(n, m)), half=True)
+        patterns += 1
+    return patterns
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--cache-dir', type=Path,
+                        default=os.environ.get('CNT_CACHE_DIR', CACHE_DIR))
+    parser.add_argument('--max-bytes', type=int,
+                        default=os.environ.get('CNT_CACHE_BYTES',
+                                               CACHE_BYTES))
+    parser.add_argument('--scale', type=float, default=SCALE)
+    parser.add_argument('--num-layer-lines', type=int, nargs='+',
+                        default=NUM_LAYER_LINES)
+    args = parser.parse_args(argv)
+
+    cache = DiskCache(args.cache_dir, int(args.max_bytes))
+    start = time.perf_counter()
+    patterns = warm(cache, args.scale, args.num_layer_lines)
+    size = sum(entry_bytes for _, entry_bytes, _ in cache.entries())
+    print(f'{patterns} patterns in {time.perf_counter() - start:.1f} s, '
+          f'{len(cache.entries())} entries ({size/2**20:.1f} MB) in '
+          f'{args.cache_dir}')
+
+
+if __name__ == '__main__':
+    main()